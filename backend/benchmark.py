@@ -0,0 +1,375 @@
+'''
+Benchmark and load test harness for the trivia API.
+
+Seeds a database with generated questions, then drives every read
+endpoint through Flask test client, reporting p50/p99 latency and
+queries per request:
+
+    python benchmark.py --database sqlite:////tmp/trivia_bench.db \
+        --questions 100000 --categories 20
+
+Use a dedicated database, seeding adds questions to it and --reset drops
+all its tables first. With --http the same scenarios are sent
+concurrently to an already running server instead, using categories and
+questions found through its API (nothing is seeded):
+
+    python benchmark.py --http http://localhost:5000 --concurrency 50
+
+Search scenarios send a different term on every request, so they measure
+searching rather than search cache hits, except "search cached" which
+repeats one term.
+
+--compare-read-paths SIZE instead compares serializing a page of SIZE
+questions through ORM objects against the column-only read path.
+'''
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+from collections import defaultdict
+
+from sqlalchemy import event, func
+
+from flaskr import create_app
+from flaskr.search import search_cache
+from models import db, Category, Question, bulk_insert_questions, \
+    format_questions, init_db
+
+SEED_BATCH_SIZE = 50000
+WORDS = ('capital', 'river', 'painter', 'planet', 'element', 'champion',
+         'novel', 'mountain', 'composer', 'empire', 'ocean', 'inventor')
+SEARCH_TERMS = ('capital', 'planet riv', 'composer', 'nothingmatches')
+MAX_PREVIOUS_QUESTIONS = 500
+DISCOVERY_PAGE_SIZE = 100
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if len(ordered) == 0:
+        return 0.0
+    pos = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[pos]
+
+
+def seed(questions, categories):
+    '''
+    Adds `categories` categories and `questions` generated questions
+    spread over them, through the bulk insert path.
+    '''
+    category_ids = []
+    for i in range(categories):
+        category = Category('Category {}'.format(i))
+        category.insert()
+        category_ids.append(category.id)
+
+    rng = random.Random(42)
+    for start in range(0, questions, SEED_BATCH_SIZE):
+        count = min(SEED_BATCH_SIZE, questions - start)
+        bulk_insert_questions([{
+            'question': 'Question {} about {} {}?'.format(
+                start + i, rng.choice(WORDS), rng.choice(WORDS)),
+            'answer': 'Answer {}'.format(start + i),
+            'difficulty': rng.randint(1, 5),
+            'category_id': rng.choice(category_ids)
+        } for i in range(count)])
+    return category_ids
+
+
+def search_bodies(terms):
+    '''
+    Returns search request bodies, one per term, in random order.
+    '''
+    bodies = [{'searchTerm': term} for term in terms]
+    random.Random(42).shuffle(bodies)
+    return bodies
+
+
+def build_scenarios(category_ids, total_questions, question_ids):
+    '''
+    Returns list of (name, method, path, body) requests covering every
+    read endpoint. body is a list for scenarios sending a different body
+    on every request, picked in turn.
+    '''
+    last_page = max(1, (total_questions + 9) // 10)
+    category = category_ids[0]
+    previous = random.sample(question_ids,
+                             min(MAX_PREVIOUS_QUESTIONS, len(question_ids)))
+    return [
+        ('questions first page', 'GET', '/api/questions', None),
+        ('questions last page', 'GET',
+         '/api/questions?page={}'.format(last_page), None),
+        ('questions cursor', 'GET', '/api/questions?after_id={}'.format(
+            max(0, total_questions - 10)), None),
+        ('categories', 'GET', '/api/categories', None),
+        ('category page', 'GET',
+         '/api/categories/{}/questions'.format(category), None),
+        ('search', 'POST', '/api/questions/search', search_bodies(
+            '{} {}'.format(first, second)
+            for first, second in itertools.permutations(WORDS, 2))),
+        ('search prefix', 'POST', '/api/questions/search', search_bodies(
+            '{} {}'.format(first, second[:3])
+            for first, second in itertools.permutations(WORDS, 2))),
+        ('search no match', 'POST', '/api/questions/search', search_bodies(
+            '{}{}'.format(SEARCH_TERMS[3], i) for i in range(1000))),
+        ('search cached', 'POST', '/api/questions/search',
+         {'searchTerm': SEARCH_TERMS[0]}),
+        ('quiz all', 'POST', '/api/quizzes',
+         {'previous_questions': [], 'quiz_category': None}),
+        ('quiz category', 'POST', '/api/quizzes',
+         {'previous_questions': [], 'quiz_category': category}),
+        ('quiz {} previous'.format(len(previous)), 'POST', '/api/quizzes',
+         {'previous_questions': previous, 'quiz_category': None}),
+    ]
+
+
+def get_body(body, pos):
+    return body[pos % len(body)] if isinstance(body, list) else body
+
+
+def discover(base_url):
+    '''
+    Returns (category ids, total questions, question ids) of a running
+    server, question ids taken from first page of every category.
+    '''
+    def get(path):
+        with urllib.request.urlopen(base_url + path) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    category_ids = [int(id) for id in get('/api/categories')['categories']]
+    if len(category_ids) == 0:
+        raise RuntimeError('{} has no categories, seed it first'.format(
+            base_url))
+    total_questions = get('/api/questions')['total_questions']
+    question_ids = []
+    for category_id in category_ids:
+        questions = get('/api/categories/{}/questions?limit={}'.format(
+            category_id, DISCOVERY_PAGE_SIZE))['questions']
+        question_ids.extend(question['id'] for question in questions)
+    return category_ids, total_questions, question_ids
+
+
+def run_test_client(app, scenarios, repeat):
+    client = app.test_client()
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', count_statement)
+    results = []
+    try:
+        for name, method, path, body in scenarios:
+            latencies = []
+            queries = []
+            # first call warms up caches, it is not measured
+            client.open(path, method=method, json=get_body(body, 0))
+            hits = search_cache.hits
+            for pos in range(1, repeat + 1):
+                del statements[:]
+                start = time.perf_counter()
+                response = client.open(path, method=method,
+                                       json=get_body(body, pos))
+                latencies.append(time.perf_counter() - start)
+                queries.append(len(statements))
+                if response.status_code != 200:
+                    raise RuntimeError('{} {} responded {}'.format(
+                        method, path, response.status_code))
+            result = summarize(name, latencies, queries)
+            result['search_cache_hits'] = search_cache.hits - hits
+            results.append(result)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_statement)
+    return results
+
+
+def run_http(base_url, scenarios, repeat, concurrency):
+    '''
+    Sends every scenario `repeat` times from `concurrency` threads to a
+    running server.
+    '''
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    jobs = [
+        (name, method, path, get_body(body, pos))
+        for name, method, path, body in scenarios for pos in range(repeat)
+    ]
+    random.shuffle(jobs)
+    jobs_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with jobs_lock:
+                if len(jobs) == 0:
+                    return
+                name, method, path, body = jobs.pop()
+            data = None if body is None else json.dumps(body).encode()
+            http_request = urllib.request.Request(
+                base_url + path, data=data, method=method,
+                headers={'Content-Type': 'application/json'})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(http_request) as response:
+                    response.read()
+            except Exception:
+                with lock:
+                    errors[name] += 1
+                continue
+            with lock:
+                latencies[name].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    results = []
+    for name, _, _, _ in scenarios:
+        result = summarize(name, latencies[name], None)
+        result['errors'] = errors[name]
+        results.append(result)
+    total = sum(len(values) for values in latencies.values())
+    return results, total / elapsed
+
+
+def compare_read_paths(size, repeat):
+    '''
+    Serializes first `size` questions through full ORM objects and through
+    format_questions() records, reporting latency and peak memory of each.
+    '''
+    def orm_page():
+        return [question.format() for question in
+                Question.query.order_by(Question.id).limit(size).all()]
+
+    def records_page():
+        return format_questions(
+            Question.query.order_by(Question.id).limit(size))
+
+    results = []
+    for name, serialize in (('orm objects', orm_page),
+                            ('column records', records_page)):
+        latencies = []
+        peaks = []
+        for _ in range(repeat):
+            # Start every run with an empty identity map
+            db.session.expunge_all()
+            tracemalloc.start()
+            start = time.perf_counter()
+            serialize()
+            latencies.append(time.perf_counter() - start)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        result = summarize(name, latencies, None)
+        result['peak_kb'] = round(max(peaks) / 1024, 1)
+        results.append(result)
+    return results
+
+
+def summarize(name, latencies, queries):
+    result = {
+        'scenario': name,
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / max(1, len(latencies)) * 1000, 3)
+    }
+    if queries is not None:
+        result['queries_per_request'] = round(
+            sum(queries) / max(1, len(queries)), 2)
+    return result
+
+
+def print_results(results):
+    columns = [column for column in results[0]]
+    widths = [
+        max(len(column), max(len(str(row[column])) for row in results))
+        for column in columns
+    ]
+    print('  '.join(column.ljust(width)
+                    for column, width in zip(columns, widths)))
+    for row in results:
+        print('  '.join(str(row[column]).ljust(width)
+                        for column, width in zip(columns, widths)))
+
+
+def run_local(args):
+    '''
+    Seeds --database and runs scenarios (or --compare-read-paths) through
+    the test client.
+    '''
+    app = create_app({'DATABASE_URL': args.database})
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        init_db()
+
+        start = time.perf_counter()
+        category_ids = seed(args.questions, args.categories)
+        total_questions = Question.query.count()
+        print('Seeded {} questions in {:.1f}s, {} questions in total'.format(
+            args.questions, time.perf_counter() - start, total_questions),
+            file=sys.stderr)
+
+        if args.compare_read_paths:
+            return compare_read_paths(args.compare_read_paths, args.repeat)
+
+        question_ids = [
+            id for id, in Question.query.with_entities(Question.id).order_by(
+                func.random()).limit(MAX_PREVIOUS_QUESTIONS)
+        ]
+        scenarios = build_scenarios(category_ids, total_questions,
+                                    question_ids)
+        return run_test_client(app, scenarios, args.repeat)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--database', default='sqlite:////tmp/trivia_bench.db',
+                        help='database URL, SQLite or Postgres (not used '
+                             'with --http)')
+    parser.add_argument('--questions', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='requests per scenario')
+    parser.add_argument('--reset', action='store_true',
+                        help='drop all tables of the database before seeding')
+    parser.add_argument('--http', help='base URL of a running server')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    parser.add_argument('--compare-read-paths', type=int, metavar='SIZE',
+                        help='compare ORM and column-only serialization '
+                             'of SIZE questions')
+    args = parser.parse_args(argv)
+
+    if args.http:
+        base_url = args.http.rstrip('/')
+        category_ids, total_questions, question_ids = discover(base_url)
+        print('Found {} categories, {} questions'.format(
+            len(category_ids), total_questions), file=sys.stderr)
+        results, throughput = run_http(
+            base_url,
+            build_scenarios(category_ids, total_questions, question_ids),
+            args.repeat, args.concurrency)
+        print('Throughput: {:.1f} requests/s'.format(throughput),
+              file=sys.stderr)
+    else:
+        results = run_local(args)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,78 @@
 import os
-from flask import Flask, request, abort, jsonify, Response
+import time
+import click
+from flask import Flask, request, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import func
 import random
 from werkzeug import exceptions as _exceptions
-from models import setup_db, Question, Category
+from models import setup_db, Question, get_categories_map, \
+    format_questions, format_question_row, format_categories, question_rows, \
+    bulk_insert_questions, get_pool_status, db, database_path, \
+    count_questions, delete_questions, update_questions_category, \
+    get_replica_status, get_question_record, init_db, parse_bool, \
+    is_pool_saturated, question_records
+from .quiz import pick_random_question
+from .sampler import sampler, RecentHistory, fallback_questions
+from .search import search_questions_page, search_cache
+from .caching import conditional
+from .metrics import init_metrics
+from .serialization import jsonify, get_json_provider, create_json_provider
+from .green import setup_async_mode
+from .sessions import SessionNotFound, create_session_store
+from .snapshot import SnapshotStore, write_snapshot
+from .routing import read_only, parse_replica_urls, init_read_routing
+from .admission import limited, reject, init_admission
+from .bulk import BulkImportError, parse_bulk_questions, \
+    validate_bulk_questions, generate_csv
 import json
 import math
-import sys
+import base64
+import binascii
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+STREAM_BATCH_SIZE = 1000
+MAX_BATCH_IDS = 10000
+
+
+def encode_cursor(last_id):
+    '''
+    Encodes id of the last question on a page into an opaque cursor
+    which can be passed back as `cursor` to fetch the next page.
+    '''
+    payload = json.dumps({'after_id': last_id}).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(cursor):
+    '''
+    Decodes cursor generated by encode_cursor. Returns None if cursor is
+    malformed.
+    '''
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return int(payload['after_id'])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        return None
 
 
 def create_app(test_config=None):
+    startedAt = time.perf_counter()
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    app.config.setdefault('ASYNC_MODE', os.environ.get('ASYNC_MODE'))
+    setup_async_mode(app.config)
+    app.extensions['json_provider'] = create_json_provider(app.config)
+    app.config.setdefault('DATABASE_URL', os.environ.get(
+        'DATABASE_URL', database_path))
+    app.config.setdefault('DATABASE_REPLICA_URLS', os.environ.get(
+        'DATABASE_REPLICA_URLS'))
+    setup_db(app, app.config['DATABASE_URL'],
+             parse_replica_urls(app.config['DATABASE_REPLICA_URLS']))
 
     '''
     DONE: @TODO: Set up CORS. Allow '*' for origins. Delete the sample route
@@ -23,6 +80,38 @@ def create_app(test_config=None):
     '''
     CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+    init_metrics(app)
+    # Before read routing, so rejected requests do not pick a replica
+    admission = init_admission(app)
+    init_read_routing(app)
+
+    sessions = create_session_store(app.config)
+
+    useSampler = app.config.get('QUIZ_SAMPLER', True)
+    sampler.max_age = app.config.get('QUIZ_SAMPLER_MAX_AGE', 300)
+    recentQuestions = RecentHistory(
+        int(app.config.get('QUIZ_RECENT_QUESTIONS', 100)))
+    maxSessionQuestions = int(app.config.get(
+        'QUIZ_SESSION_MAX_QUESTIONS', 1000))
+    search_cache.max_size = int(app.config.get('SEARCH_CACHE_SIZE', 1024))
+    search_cache.ttl = float(app.config.get('SEARCH_CACHE_TTL', 60))
+    degradedQuiz = parse_bool(app.config.get(
+        'QUIZ_DEGRADED_MODE', os.environ.get('QUIZ_DEGRADED_MODE', True)))
+    fallback_questions.max_size = int(app.config.get(
+        'QUIZ_FALLBACK_CACHE_SIZE', 1000))
+
+    app.config.setdefault('QUESTION_SNAPSHOT', os.environ.get(
+        'QUESTION_SNAPSHOT'))
+    snapshots = None
+    if app.config['QUESTION_SNAPSHOT']:
+        snapshots = SnapshotStore(
+            app.config['QUESTION_SNAPSHOT'],
+            float(app.config.get('QUESTION_SNAPSHOT_CHECK_INTERVAL', 1)))
+    app.extensions['question_snapshots'] = snapshots
+    # Buckets and tables of a previous snapshot (or none) are stale
+    sampler.snapshots = snapshots
+    sampler.invalidate()
+
     # Setup CORS header
     '''
     DONE: @TODO: Use the after_request decorator to set Access-Control-Allow
@@ -36,10 +125,139 @@ def create_app(test_config=None):
                              'GET, POST, PUT, PATCH, DELETE')
         return response
 
-    def getPaginatedResult(result, page, size=QUESTIONS_PER_PAGE):
-        start = QUESTIONS_PER_PAGE * (page - 1)
-        end = QUESTIONS_PER_PAGE * page
-        return result[start:end]
+    def getPaginatedResult(query, page, size=QUESTIONS_PER_PAGE):
+        return query.order_by(Question.id).limit(size).offset(
+            size * (page - 1))
+
+    def getKeysetResult(query, after_id, size=QUESTIONS_PER_PAGE):
+        return query.filter(Question.id > after_id).order_by(
+            Question.id).limit(size)
+
+    def getSnapshot():
+        return None if snapshots is None else snapshots.get()
+
+    def getCategories():
+        snapshot = getSnapshot()
+        if snapshot is None:
+            return get_categories_map()
+        return snapshot.categories
+
+    def countQuestions(category_id=None):
+        snapshot = getSnapshot()
+        if snapshot is None:
+            return count_questions(category_id)
+        return snapshot.count(category_id)
+
+    def getQuestionsPage(category_id, page, after_id,
+                         size=QUESTIONS_PER_PAGE):
+        '''
+        Returns serialized questions of requested page (or the page after
+        after_id), of all categories for category_id None. Served from
+        published snapshot if there is one, database otherwise.
+        '''
+        snapshot = getSnapshot()
+        if snapshot is not None:
+            if after_id is not None:
+                return snapshot.format(
+                    snapshot.page_after(category_id, after_id, size))
+            return snapshot.format(
+                snapshot.page(category_id, size * (page - 1), size))
+
+        query = Question.query
+        if category_id is not None:
+            query = query.filter(Question.category_id == category_id)
+        if after_id is not None:
+            return format_questions(getKeysetResult(query, after_id, size))
+        return format_questions(getPaginatedResult(query, page, size))
+
+    def getQuestion(id):
+        snapshot = getSnapshot()
+        if snapshot is None:
+            return get_question_record(id)
+        return snapshot.get(id)
+
+    def formatQuestion(question):
+        snapshot = getSnapshot()
+        if snapshot is None:
+            return question.format()
+        return question.format(snapshot.formatted_categories)
+
+    def getAfterId():
+        '''
+        Reads keyset position from either opaque `cursor` or raw `after_id`
+        query param. Returns None when page based pagination is requested.
+        '''
+        cursor = request.args.get('cursor')
+        if cursor is not None:
+            after_id = decode_cursor(cursor)
+            if after_id is None:
+                abort(400, 'Invalid cursor')
+            return after_id
+
+        if 'after_id' in request.args:
+            after_id = request.args.get('after_id', type=int)
+            if after_id is None:
+                abort(400, 'Invalid after_id')
+            return after_id
+
+        return None
+
+    def getPageSize():
+        size = request.args.get('limit', QUESTIONS_PER_PAGE, type=int)
+        if size < 1 or size > MAX_QUESTIONS_PER_PAGE:
+            abort(400, 'limit should be between 1 and {}'.format(
+                MAX_QUESTIONS_PER_PAGE))
+        return size
+
+    def streamQuestions(query, stream):
+        '''
+        Streams all questions of query either as NDJSON, one question per
+        line, as chunked JSON array or as CSV. Rows are fetched in batches
+        through server-side cursor, so memory stays flat regardless of
+        query size.
+        '''
+        dumps = get_json_provider().dumps_compact
+        categories = format_categories(get_categories_map())
+        rows = question_rows(query.order_by(Question.id)).yield_per(
+            STREAM_BATCH_SIZE)
+
+        def batches():
+            batch = []
+            for row in rows:
+                batch.append(format_question_row(row, categories))
+                if len(batch) == STREAM_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if len(batch) > 0:
+                yield batch
+
+        def generateNdjson():
+            for batch in batches():
+                yield b''.join(dumps(question) + b'\n' for question in batch)
+
+        def generateJsonArray():
+            separator = b'['
+            for batch in batches():
+                # strip brackets of serialized batch to splice it in
+                yield separator + dumps(batch)[1:-1]
+                separator = b','
+            yield b'[]' if separator == b'[' else b']'
+
+        if stream == 'ndjson':
+            return Response(stream_with_context(generateNdjson()),
+                            mimetype='application/x-ndjson')
+        if stream == 'json':
+            return Response(stream_with_context(generateJsonArray()),
+                            mimetype='application/json')
+        if stream == 'csv':
+            return Response(stream_with_context(generate_csv(rows)),
+                            mimetype='text/csv')
+        abort(400, 'stream should be one of json, ndjson or csv')
+
+    def getNextCursor(questions, size=QUESTIONS_PER_PAGE):
+        if len(questions) < size:
+            return None
+        return encode_cursor(questions[-1]['id'])
 
     '''
     DONE: @TODO:
@@ -47,10 +265,9 @@ def create_app(test_config=None):
     for all available categories.
     '''
     @app.route('/api/categories', methods=['GET'])
+    @conditional
     def get_categories():
-        categories = {
-            category.id: category.type for category in Category.query.all()
-        }
+        categories = getCategories()
         return jsonify({
             'categories': categories,
             'total_categories': len(categories)
@@ -69,31 +286,26 @@ def create_app(test_config=None):
     for three pages.Clicking on the page numbers should update the questions.
     '''
     @app.route('/api/questions', methods=['GET'])
+    @conditional
     def get_questions():
         page = request.args.get('page', 1, type=int)
-        start = QUESTIONS_PER_PAGE * (page - 1)
-        end = QUESTIONS_PER_PAGE * page
-        queryResult = Question.query.all()
-
-        total_questions = len(queryResult)
-        maxPages = math.ceil(total_questions / QUESTIONS_PER_PAGE)
-        if (total_questions > 0 and page > maxPages):
-            abort(Response("Invalid Page Number"))
-
-        questionsPerPage = getPaginatedResult(queryResult, page)
-
-        questions = [
-            question.format() for question in questionsPerPage
-        ]
-        categories = {
-            category.id: category.type for category in Category.query.all()
-        }
+        after_id = getAfterId()
+        total_questions = countQuestions()
+
+        if after_id is None:
+            maxPages = math.ceil(total_questions / QUESTIONS_PER_PAGE)
+            if (page < 1 or (total_questions > 0 and page > maxPages)):
+                abort(Response("Invalid Page Number"))
+
+        questions = getQuestionsPage(None, page, after_id)
+        categories = getCategories()
 
         return jsonify({
             'questions': questions,
             'total_questions': total_questions,
             'categories': categories,
-            'current_category': None
+            'current_category': None,
+            'next_cursor': getNextCursor(questions)
         })
 
     '''
@@ -115,7 +327,7 @@ def create_app(test_config=None):
                 'message': 'Question deleted successfully'
             })
         except Exception:
-            print(sys.exc_info())
+            app.logger.exception('Failed to delete question %s', id)
             abort(400, 'Failed to delete question with requested id')
 
     '''
@@ -144,13 +356,16 @@ def create_app(test_config=None):
         if not question or not answer or not difficulty or not category:
             abort(400, 'Invalid question data.')
 
-        category = Category.query.filter(Category.id == category).one_or_none()
-        if category is None:
+        try:
+            category = int(category)
+        except (TypeError, ValueError):
+            abort(400, 'Specified category not found.')
+
+        if category not in get_categories_map():
             abort(400, 'Specified category not found.')
 
         try:
-            question = Question(question, answer, category.id, difficulty)
-            question.category = category
+            question = Question(question, answer, category, difficulty)
             question.insert()
 
             return jsonify(question.format())
@@ -158,6 +373,114 @@ def create_app(test_config=None):
             abort(500, "Failed to save question")
             pass
 
+    @app.route('/api/questions/bulk', methods=['POST'])
+    def bulk_add_questions():
+        upload = request.files.get('file')
+        if upload is not None:
+            body, content_type = upload.read(), upload.mimetype
+        else:
+            body, content_type = request.get_data(), request.mimetype
+
+        try:
+            records = parse_bulk_questions(body, content_type)
+            mappings = validate_bulk_questions(records, get_categories_map())
+        except BulkImportError as e:
+            return jsonify({
+                'code': 400,
+                'error': 'Bad Request',
+                'details': e.description,
+                'errors': e.errors
+            }), 400
+
+        try:
+            inserted = bulk_insert_questions(mappings)
+        except Exception:
+            app.logger.exception('Failed to save questions')
+            abort(500, 'Failed to save questions')
+
+        return jsonify({
+            'inserted': inserted
+        })
+
+    def getQuestionFilter(data):
+        '''
+        Parses `ids`, `category` and `difficulty` filter of batch requests
+        into keyword arguments of models.delete_questions. At least one
+        filter is required, so a batch never applies to every question.
+        '''
+        if not isinstance(data, dict):
+            abort(400, 'Invalid data')
+
+        ids = data.get('ids')
+        category = data.get('category')
+        difficulty = data.get('difficulty')
+        if ids is None and category is None and difficulty is None:
+            abort(400, 'ids, category or difficulty is required')
+
+        if ids is not None:
+            if not isinstance(ids, list) or len(ids) > MAX_BATCH_IDS or \
+                    not all(type(id) is int for id in ids):
+                abort(400, 'ids should be a list of at most {} ids'.format(
+                    MAX_BATCH_IDS))
+        # int(True) is 1, booleans are not ids
+        if isinstance(category, bool) or isinstance(difficulty, bool):
+            abort(400, 'Invalid category or difficulty')
+        try:
+            if category is not None:
+                category = int(category)
+            if difficulty is not None:
+                difficulty = int(difficulty)
+        except (TypeError, ValueError):
+            abort(400, 'Invalid category or difficulty')
+
+        return {
+            'ids': ids,
+            'category_id': category,
+            'difficulty': difficulty
+        }
+
+    @app.route('/api/questions', methods=['DELETE'])
+    def batch_delete_questions():
+        questionFilter = getQuestionFilter(request.get_json(silent=True))
+        try:
+            deleted = delete_questions(**questionFilter)
+        except Exception:
+            app.logger.exception('Failed to delete questions')
+            abort(500, 'Failed to delete questions')
+
+        return jsonify({
+            'deleted': deleted
+        })
+
+    @app.route('/api/questions', methods=['PATCH'])
+    def batch_update_questions():
+        data = request.get_json(silent=True)
+        questionFilter = getQuestionFilter(data)
+        changes = data.get('set')
+        if not isinstance(changes, dict) or set(changes) != {'category'}:
+            abort(400, 'set should contain new category')
+        try:
+            category = int(changes['category'])
+        except (TypeError, ValueError):
+            abort(400, 'Specified category not found.')
+        if category not in get_categories_map():
+            abort(400, 'Specified category not found.')
+
+        try:
+            updated = update_questions_category(category, **questionFilter)
+        except Exception:
+            app.logger.exception('Failed to update questions')
+            abort(500, 'Failed to update questions')
+
+        return jsonify({
+            'updated': updated
+        })
+
+    @app.route('/api/questions/export', methods=['GET'])
+    def export_questions():
+        return streamQuestions(
+            Question.query, request.args.get('format', 'ndjson'))
+
     '''
     DONE: @TODO:
     Create a POST endpoint to get questions based on a search term.
@@ -169,18 +492,18 @@ def create_app(test_config=None):
     Try using the word "title" to start.
     '''
     @app.route('/api/questions/search', methods=['POST'])
+    @read_only
+    @limited('search')
     def search_questions():
         data = request.get_json()
         searchTerm = data['searchTerm']
-        page = 1
-        queryResult = Question.query.filter(
-            Question.question.ilike('%{}%'.format(searchTerm))).all()
-        total_questions = len(queryResult)
-        questionsPerPage = getPaginatedResult(queryResult, page)
+        page = data.get('page', 1)
+        if not isinstance(page, int) or page < 1:
+            abort(400, 'Invalid page number')
 
-        questions = [
-            question.format() for question in questionsPerPage
-        ]
+        total_questions, questions = search_questions_page(
+            searchTerm, page, QUESTIONS_PER_PAGE,
+            include_answers=bool(data.get('searchAnswers', False)))
 
         return jsonify({
             'questions': questions,
@@ -197,17 +520,32 @@ def create_app(test_config=None):
     category to be shown.
     '''
     @app.route('/api/categories/<int:id>/questions')
+    @conditional
     def get_questions_by_category(id):
-        category = Category.query.filter(Category.id == id).one_or_none()
-        if category is None:
+        if id not in getCategories():
             abort(400, "Category not found")
 
-        questions = [question.format() for question in Question.query.filter(
-            Question.category_id == category.id).all()]
+        query = Question.query.filter(Question.category_id == id)
+        stream = request.args.get('stream')
+        if stream is not None:
+            return streamQuestions(query, stream)
+
+        page = request.args.get('page', 1, type=int)
+        size = getPageSize()
+        after_id = getAfterId()
+        total_questions = countQuestions(id)
+
+        if after_id is None and page < 1:
+            abort(400, 'Invalid Page Number')
+
+        # Pages past the last one are empty. Frontend keeps page number of
+        # the main list when switching to a category.
+        questions = getQuestionsPage(id, page, after_id, size)
         return jsonify({
             'questions': questions,
-            'total_questions': len(questions),
-            'current_category': id
+            'total_questions': total_questions,
+            'current_category': id,
+            'next_cursor': getNextCursor(questions, size)
         })
 
     '''
@@ -222,27 +560,219 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     '''
     @app.route('/api/quizzes', methods=['POST'])
+    @read_only
+    @limited('quiz')
     def get_random_question():
         data = request.get_json()
+        if data.get('session_id') is not None:
+            return jsonify(nextSessionQuestion(data['session_id']))
+
         previous_questions = data['previous_questions']
         quiz_category = data['quiz_category']
 
-        questionsSubQuery = Question.query
+        if degradedQuiz and getSnapshot() is None and is_pool_saturated():
+            return degradedQuizQuestion(data, set(previous_questions))
+
+        if not useSampler:
+            questionsSubQuery = Question.query
+            if quiz_category is not None:
+                questionsSubQuery = questionsSubQuery.filter(
+                    Question.category_id == quiz_category)
+            question = pick_random_question(
+                questionsSubQuery, previous_questions)
+        else:
+            question = sampleQuestion(
+                getQuizCategories(data), getQuizDifficulties(data),
+                set(previous_questions), data.get('client_id'))
+
+        if question is None:
+            return jsonify({})
+
+        fallback_questions.add(question)
+        return jsonify({
+            'question': formatQuestion(question)
+        })
+
+    def degradedQuizQuestion(data, excluded):
+        '''
+        Serves a question from recently served ones, without waiting for
+        a database connection. Clients get 503 with Retry-After when none
+        of them fits.
+        '''
+        question = fallback_questions.sample(
+            getQuizCategories(data), getQuizDifficulties(data), excluded)
+        if question is None:
+            admission['quiz'].count('overloaded')
+            return reject(503, 'Service Unavailable',
+                          'Database is overloaded, try again later',
+                          admission['quiz'].retry_after)
+
+        admission['quiz'].count('degraded')
+        response = jsonify({
+            'question': formatQuestion(question)
+        })
+        response.headers['X-Degraded'] = '1'
+        return response
+
+    def getQuizCategories(data):
+        '''
+        Reads category weights of weighted quiz, e.g. {"1": 3, "4": 1}
+        picks questions of category 1 three times as often as of category
+        4. Falls back to quiz_category, None means all categories.
+        '''
+        weights = data.get('categories')
+        if weights is None:
+            quiz_category = data.get('quiz_category')
+            if quiz_category is None:
+                return None
+            try:
+                return {int(quiz_category): 1}
+            except (TypeError, ValueError):
+                abort(400, 'Invalid quiz category')
+
+        categories = getCategories()
+        try:
+            weights = {
+                int(category): float(weight)
+                for category, weight in weights.items()
+            }
+        except (AttributeError, TypeError, ValueError):
+            abort(400, 'Invalid category weights')
+        if any(category not in categories or weight < 0
+               for category, weight in weights.items()):
+            abort(400, 'Invalid category weights')
+        return weights
+
+    def getQuizDifficulties(data):
+        '''
+        Reads difficulty band, either a single difficulty or [min, max].
+        '''
+        difficulty = data.get('difficulty')
+        if difficulty is None:
+            return None
+        if isinstance(difficulty, int):
+            return (difficulty, difficulty)
+        if isinstance(difficulty, list) and len(difficulty) == 2 and \
+                all(isinstance(value, int) for value in difficulty):
+            return tuple(difficulty)
+        abort(400, 'Invalid difficulty')
+
+    def sampleQuestion(categories, difficulties, excluded, client_id=None):
+        recent = set()
+        if client_id is not None:
+            recent = recentQuestions.get(client_id)
+
+        while True:
+            id = sampler.sample(categories, difficulties, excluded | recent)
+            if id is None and len(recent) > 0:
+                # Client has seen all of them recently, allow repeats
+                recent = set()
+                continue
+            if id is None:
+                return None
+
+            # Question might have been deleted by another worker
+            question = getQuestion(id)
+            if question is None:
+                sampler.discard(id)
+                excluded.add(id)
+                continue
+
+            if client_id is not None:
+                recentQuestions.add(client_id, id)
+            return question
+
+    def nextSessionQuestion(session_id):
+        while True:
+            try:
+                id = sessions.pop(session_id)
+            except SessionNotFound:
+                abort(404, 'Quiz session not found or expired')
+
+            if id is None:
+                return {}
+
+            # Question might have been deleted since session was created
+            question = getQuestion(id)
+            if question is not None:
+                return {
+                    'question': formatQuestion(question)
+                }
+
+    '''
+    Server side quiz sessions. Session keeps pre-shuffled question ids of
+    the chosen category, so client only sends session_id on every turn
+    instead of the whole previous_questions history.
+    '''
+    @app.route('/api/quizzes/sessions', methods=['POST'])
+    @read_only
+    @limited('quiz')
+    def create_quiz_session():
+        data = request.get_json() or {}
+        quiz_category = data.get('quiz_category')
+        limit = data.get('limit', maxSessionQuestions)
+        if not isinstance(limit, int) or limit < 1 or \
+                limit > maxSessionQuestions:
+            abort(400, 'limit should be between 1 and {}'.format(
+                maxSessionQuestions))
+
         if quiz_category is not None:
-            questionsSubQuery = questionsSubQuery.filter(
-                Question.category_id == quiz_category)
+            # Frontend sends category ids as strings
+            try:
+                quiz_category = int(quiz_category)
+            except (TypeError, ValueError):
+                abort(400, 'Invalid quiz category')
+            if quiz_category not in getCategories():
+                abort(400, 'Category not found')
+
+        if useSampler:
+            ids = sampler.candidates(
+                None if quiz_category is None else {quiz_category: 1})
+        else:
+            query = Question.query.with_entities(Question.id)
+            if quiz_category is not None:
+                query = query.filter(Question.category_id == quiz_category)
+            ids = [row.id for row in query.yield_per(STREAM_BATCH_SIZE)]
+        ids = random.sample(ids, min(limit, len(ids)))
+        return jsonify({
+            'session_id': sessions.create(ids),
+            'total_questions': len(ids)
+        })
 
-        questions = questionsSubQuery.filter(
-            Question.id.notin_(previous_questions)).all()
-        if len(questions) == 0:
-            return jsonify({})
+    @app.route('/api/quizzes/sessions/<session_id>/next', methods=['POST'])
+    @read_only
+    @limited('quiz')
+    def get_session_question(session_id):
+        return jsonify(nextSessionQuestion(session_id))
 
-        randomPos = random.randint(0, len(questions) - 1)
-        question = questions[randomPos]
+    @app.route('/api/quizzes/sessions/<session_id>', methods=['DELETE'])
+    @read_only
+    def delete_quiz_session(session_id):
+        sessions.delete(session_id)
         return jsonify({
-            'question': question.format()
+            'message': 'Quiz session deleted successfully'
         })
 
+    @app.route('/api/health', methods=['GET'])
+    def get_health():
+        try:
+            db.session.execute('SELECT 1')
+            database = 'ok'
+        except Exception:
+            app.logger.exception('Database health check failed')
+            db.session.rollback()
+            database = 'unavailable'
+
+        return jsonify({
+            'database': database,
+            'pool': get_pool_status(),
+            'replicas': get_replica_status(),
+            'startup': app.extensions['startup'],
+            'admission': {
+                name: group.format() for name, group in admission.items()
+            }
+        }), 200 if database == 'ok' else 503
+
     '''
     DONE: @TODO:
     Create error handlers for all expected errors
@@ -253,9 +783,18 @@ def create_app(test_config=None):
         return jsonify({
             'code': 500,
             'error': 'Internal Server Error',
-            'details': e.description
+            # Unhandled exceptions have no description
+            'details': getattr(e, 'description', None)
         }), 500
 
+    @app.errorhandler(404)
+    def handle_not_found(e):
+        return jsonify({
+            'code': 404,
+            'error': 'Not Found',
+            'details': e.description
+        }), 404
+
     @app.errorhandler(400)
     def handle_internal_server_error(e):
         return jsonify({
@@ -264,4 +803,59 @@ def create_app(test_config=None):
             'details': e.description
         }), 400
 
+    @app.cli.command('init-db')
+    def init_db_command():
+        '''
+        Create missing tables and apply pending migrations.
+        '''
+        init_db()
+        click.echo('Database initialized')
+
+    @app.cli.command('export-snapshot')
+    @click.argument('path', required=False)
+    def export_snapshot_command(path):
+        '''
+        Publish snapshot of the question bank, to PATH or QUESTION_SNAPSHOT.
+        '''
+        path = path or app.config['QUESTION_SNAPSHOT']
+        if not path:
+            raise click.UsageError('PATH or QUESTION_SNAPSHOT is required')
+        version = write_snapshot(path)
+        click.echo('Published snapshot {} to {}'.format(version, path))
+
+    def warmUp():
+        '''
+        Preloads categories, question counts, quiz sampler buckets and
+        fallback quiz questions, so first requests of a new worker do not
+        pay for loading them and degraded mode has questions to serve.
+        '''
+        with app.app_context():
+            try:
+                getSnapshot()
+                get_categories_map()
+                count_questions()
+                if useSampler:
+                    sampler.get_buckets()
+                if degradedQuiz and getSnapshot() is None:
+                    query = Question.query.order_by(func.random()).limit(
+                        fallback_questions.max_size)
+                    for question in question_records(query):
+                        fallback_questions.add(question)
+            except Exception:
+                app.logger.exception('Warm-up failed')
+
+    warmUpSeconds = None
+    app.config.setdefault('WARM_UP', os.environ.get('WARM_UP', False))
+    if parse_bool(app.config['WARM_UP']):
+        warmUpStartedAt = time.perf_counter()
+        warmUp()
+        warmUpSeconds = round(time.perf_counter() - warmUpStartedAt, 6)
+
+    app.extensions['startup'] = {
+        'seconds': round(time.perf_counter() - startedAt, 6),
+        'warm_up_seconds': warmUpSeconds
+    }
+    app.logger.info('App created in %.1f ms (warm-up %s s)',
+                    1000 * app.extensions['startup']['seconds'],
+                    warmUpSeconds)
     return app
@@ -0,0 +1,216 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request
+
+from .serialization import jsonify
+
+'''
+Admission control
+    views decorated with limited(group) are admitted through the limits of
+    their group before they run. Every client (remote address, or value
+    of RATE_LIMIT_CLIENT_HEADER) gets a token bucket of <GROUP>_RATE_LIMIT
+    requests per second with bursts of up to <GROUP>_RATE_BURST, and at
+    most <GROUP>_MAX_CONCURRENCY requests of the group run at once in a
+    worker process. Requests over the limits are answered right away with
+    429 (rate) or 503 (concurrency) and Retry-After, instead of queueing
+    for database connections. Limits set to 0 are off.
+'''
+
+GROUPS = ('quiz', 'search')
+DEFAULT_RETRY_AFTER = 1
+
+
+def limited(group):
+    '''
+    Marks a view to be admitted through limits of group.
+    '''
+    def decorator(view):
+        view.admission_group = group
+        return view
+    return decorator
+
+
+def reject(status, error, details, retry_after):
+    response = jsonify({
+        'code': status,
+        'error': error,
+        'details': details
+    })
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class RateLimiter:
+    '''
+    Token bucket per client, refilled at rate tokens per second up to
+    burst tokens. Least recently seen clients are forgotten once
+    max_clients are tracked.
+    '''
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self.clients = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, client_id, now=None):
+        '''
+        Takes a token of client. Returns 0 when client had one, otherwise
+        seconds until it has.
+        '''
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            bucket = self.clients.get(client_id)
+            if bucket is None:
+                bucket = self.clients[client_id] = [self.burst, now]
+            else:
+                self.clients.move_to_end(client_id)
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            while len(self.clients) > self.max_clients:
+                self.clients.popitem(last=False)
+
+            if tokens >= 1.0:
+                bucket[0] = tokens - 1.0
+                return 0.0
+            bucket[0] = tokens
+            return (1.0 - tokens) / self.rate
+
+
+class ConcurrencyLimiter:
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+class AdmissionGroup:
+
+    def __init__(self, name, max_concurrency=0, rate=0, burst=None,
+                 retry_after=DEFAULT_RETRY_AFTER):
+        self.name = name
+        self.concurrency = ConcurrencyLimiter(max_concurrency) \
+            if max_concurrency > 0 else None
+        self.rate = RateLimiter(rate, rate if burst is None else burst) \
+            if rate > 0 else None
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.rate_limited = 0
+        self.overloaded = 0
+        self.degraded = 0
+
+    def admit(self, client_id):
+        '''
+        Returns None when request is admitted (and holds a concurrency slot
+        until release()), otherwise the rejection response.
+        '''
+        if self.rate is not None:
+            wait = self.rate.acquire(client_id)
+            if wait > 0:
+                self.count('rate_limited')
+                return reject(429, 'Too Many Requests',
+                              'Rate limit of {} exceeded'.format(self.name),
+                              wait)
+
+        if self.concurrency is not None and not self.concurrency.acquire():
+            self.count('overloaded')
+            return reject(503, 'Service Unavailable',
+                          'Too many concurrent {} requests'.format(self.name),
+                          self.retry_after)
+
+        self.count('admitted')
+        return None
+
+    def release(self):
+        if self.concurrency is not None:
+            self.concurrency.release()
+
+    def count(self, stat):
+        with self.lock:
+            setattr(self, stat, getattr(self, stat) + 1)
+
+    def format(self):
+        with self.lock:
+            return {
+                'max_concurrency': 0 if self.concurrency is None
+                else self.concurrency.limit,
+                'in_flight': 0 if self.concurrency is None
+                else self.concurrency.in_flight,
+                'rate_limit': 0 if self.rate is None else self.rate.rate,
+                'rate_burst': 0 if self.rate is None else self.rate.burst,
+                'admitted': self.admitted,
+                'rate_limited': self.rate_limited,
+                'overloaded': self.overloaded,
+                'degraded': self.degraded
+            }
+
+
+def get_config(app, key, default):
+    return float(app.config.get(key, os.environ.get(key, default)))
+
+
+def get_client_id(app):
+    header = app.config.get('RATE_LIMIT_CLIENT_HEADER',
+                            os.environ.get('RATE_LIMIT_CLIENT_HEADER'))
+    if header and request.headers.get(header):
+        return request.headers[header]
+    return request.remote_addr
+
+
+def init_admission(app):
+    '''
+    Installs admission control of GROUPS on app. Returns groups by name,
+    also kept in app.extensions['admission'].
+    '''
+    retry_after = get_config(app, 'ADMISSION_RETRY_AFTER',
+                             DEFAULT_RETRY_AFTER)
+    groups = {}
+    for name in GROUPS:
+        prefix = name.upper()
+        rate = get_config(app, prefix + '_RATE_LIMIT', 0)
+        groups[name] = AdmissionGroup(
+            name,
+            int(get_config(app, prefix + '_MAX_CONCURRENCY', 0)),
+            rate,
+            get_config(app, prefix + '_RATE_BURST', rate),
+            retry_after)
+    app.extensions['admission'] = groups
+
+    @app.before_request
+    def admit_request():
+        view = app.view_functions.get(request.endpoint)
+        group = groups.get(getattr(view, 'admission_group', None))
+        # CORS preflight requests do not run the view
+        if group is None or request.method == 'OPTIONS':
+            return None
+        response = group.admit(get_client_id(app))
+        if response is None:
+            g.admission_group = group
+        return response
+
+    @app.teardown_request
+    def release_request(exception=None):
+        group = g.pop('admission_group', None)
+        if group is not None:
+            group.release()
+
+    return groups
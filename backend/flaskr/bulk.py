@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+
+CSV_COLUMNS = ['id', 'question', 'answer', 'difficulty', 'category']
+
+
+class BulkImportError(Exception):
+
+    def __init__(self, description, errors=None):
+        super().__init__(description)
+        self.description = description
+        self.errors = errors or []
+
+
+def parse_bulk_questions(body, content_type):
+    '''
+    Parses uploaded question pack into list of records. Supports JSON
+    array, NDJSON (one JSON object per line) and CSV with header row.
+    '''
+    content_type = (content_type or '').split(';')[0].strip().lower()
+
+    try:
+        # UnicodeDecodeError is a ValueError too
+        text = body.decode('utf-8-sig') if isinstance(body, bytes) else body
+        if content_type in ('text/csv', 'application/csv'):
+            return list(csv.DictReader(io.StringIO(text)))
+
+        if content_type in ('application/x-ndjson', 'application/ndjson'):
+            return [
+                json.loads(line) for line in text.splitlines() if line.strip()
+            ]
+
+        records = json.loads(text)
+    except (ValueError, csv.Error):
+        raise BulkImportError('Malformed {} payload'.format(
+            content_type or 'request'))
+
+    if not isinstance(records, list):
+        raise BulkImportError('Expected an array of questions')
+    return records
+
+
+def validate_bulk_questions(records, categories):
+    '''
+    Validates records against prefetched categories map and returns them
+    as Question column mappings. Raises BulkImportError listing every
+    invalid record, so nothing gets inserted from a partially bad pack.
+    '''
+    mappings = []
+    errors = []
+    for pos, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append({'index': pos, 'error': 'Invalid question data.'})
+            continue
+
+        question = record.get('question')
+        answer = record.get('answer')
+        try:
+            difficulty = int(record.get('difficulty'))
+            category = int(record.get('category'))
+        except (TypeError, ValueError):
+            errors.append({'index': pos, 'error': 'Invalid question data.'})
+            continue
+
+        if not question or not answer or difficulty < 1:
+            errors.append({'index': pos, 'error': 'Invalid question data.'})
+        elif category not in categories:
+            errors.append({
+                'index': pos,
+                'error': 'Specified category not found.'
+            })
+        else:
+            mappings.append({
+                'question': question,
+                'answer': answer,
+                'difficulty': difficulty,
+                'category_id': category
+            })
+
+    if len(errors) > 0:
+        raise BulkImportError('Invalid questions in payload', errors)
+    return mappings
+
+
+def generate_csv(rows):
+    '''
+    Yields CSV export of question rows (see models.question_rows) line by
+    line, in the format accepted by parse_bulk_questions.
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for id, question, answer, category_id, difficulty in rows:
+        writer.writerow([id, question, answer, difficulty, category_id])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
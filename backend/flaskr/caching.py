@@ -0,0 +1,69 @@
+import hashlib
+import os
+import time
+from functools import wraps
+
+from flask import current_app, request, make_response
+
+from models import get_data_version
+
+DEFAULT_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+DEFAULT_ETAG_MAX_AGE = 60
+
+
+def make_etag():
+    '''
+    Derives ETag of current request from data version (and version of
+    published question snapshot) and the request path with its query
+    params, so ETag changes whenever either does.
+
+    Data version is kept per process and does not change on writes made
+    by other worker processes, so ETags also expire every
+    HTTP_ETAG_MAX_AGE seconds (0 = never, for a single process). Clients
+    then revalidate stale data within that time at the latest.
+    '''
+    version = get_data_version()
+    snapshots = current_app.extensions.get('question_snapshots')
+    snapshot = None if snapshots is None else snapshots.get()
+    if snapshot is not None:
+        version += '.' + snapshot.version
+    max_age = get_etag_max_age()
+    if max_age > 0:
+        version += '.{}'.format(int(time.time() // max_age))
+    key = '{}?{}#{}'.format(
+        request.path,
+        '&'.join('{}={}'.format(name, value)
+                 for name, value in sorted(request.args.items(multi=True))),
+        version)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_etag_max_age():
+    return float(current_app.config.get('HTTP_ETAG_MAX_AGE', os.environ.get(
+        'HTTP_ETAG_MAX_AGE', DEFAULT_ETAG_MAX_AGE)))
+
+
+def conditional(view):
+    '''
+    Decorates read endpoint with HTTP caching. Requests whose
+    If-None-Match carries current ETag are answered with 304 before
+    the view runs, so they never touch the database.
+    '''
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        etag = make_etag()
+        cache_control = current_app.config.get(
+            'HTTP_CACHE_CONTROL', DEFAULT_CACHE_CONTROL)
+
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    return decorated
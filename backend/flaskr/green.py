@@ -0,0 +1,53 @@
+'''
+Cooperative serving mode
+    lets a single worker process serve thousands of concurrent requests
+    with gevent greenlets instead of one thread per request. The app stays
+    a WSGI app with the same routes, models and JSON contracts, run with
+
+        ASYNC_MODE=gevent gunicorn -k gevent --worker-connections 2000 \
+            'flaskr:create_app()'
+
+    gevent worker patches the standard library, psycopg2 talks to the
+    socket in C though, so it has to be told to yield to other greenlets
+    while waiting on Postgres. That is what patch_psycopg() does.
+'''
+
+
+def gevent_wait_callback(connection, timeout=None):
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import extensions, OperationalError
+
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise OperationalError('Bad result from poll: {}'.format(state))
+
+
+def patch_psycopg():
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        raise RuntimeError('ASYNC_MODE=gevent requires gevent package')
+
+    from psycopg2 import extensions
+    extensions.set_wait_callback(gevent_wait_callback)
+
+
+def is_patched():
+    from psycopg2 import extensions
+    return extensions.get_wait_callback() is not None
+
+
+def setup_async_mode(config):
+    mode = config.get('ASYNC_MODE')
+    if mode is None:
+        return
+    if mode != 'gevent':
+        raise ValueError('Unknown ASYNC_MODE {}'.format(mode))
+    patch_psycopg()
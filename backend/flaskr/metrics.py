@@ -0,0 +1,241 @@
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import get_pool_status
+from .search import search_cache
+
+'''
+Request instrumentation
+    every request records wall time, time spent in the database, number
+    of queries and rows fetched, aggregated per endpoint and exposed in
+    Prometheus text format at /metrics. Queries are counted through
+    SQLAlchemy cursor execution events.
+'''
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class EndpointStats:
+
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.duration = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.rows = 0
+
+    def record(self, status, duration, db_time, queries, rows):
+        self.requests[status] += 1
+        self.count += 1
+        self.duration += duration
+        self.db_time += db_time
+        self.queries += queries
+        self.rows += rows
+        for pos, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                self.buckets[pos] += 1
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = defaultdict(EndpointStats)
+
+    def record(self, endpoint, method, status, duration, db_time, queries,
+               rows):
+        with self.lock:
+            self.endpoints[(endpoint, method)].record(
+                status, duration, db_time, queries, rows)
+
+    def render(self):
+        '''
+        Renders collected metrics in Prometheus text exposition format.
+        '''
+        lines = []
+
+        def metric(name, type, help):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} {}'.format(name, type))
+
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+
+            metric('trivia_requests_total', 'counter',
+                   'HTTP requests by endpoint and status')
+            for (endpoint, method), stats in endpoints:
+                for status, count in sorted(stats.requests.items()):
+                    lines.append(
+                        'trivia_requests_total{{endpoint="{}",method="{}",'
+                        'status="{}"}} {}'.format(
+                            endpoint, method, status, count))
+
+            metric('trivia_request_duration_seconds', 'histogram',
+                   'Request wall time')
+            for (endpoint, method), stats in endpoints:
+                labels = 'endpoint="{}",method="{}"'.format(endpoint, method)
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    lines.append(
+                        'trivia_request_duration_seconds_bucket{{{},'
+                        'le="{}"}} {}'.format(labels, bound, count))
+                lines.append(
+                    'trivia_request_duration_seconds_bucket{{{},'
+                    'le="+Inf"}} {}'.format(labels, stats.count))
+                lines.append('trivia_request_duration_seconds_sum{{{}}} '
+                             '{:.6f}'.format(labels, stats.duration))
+                lines.append('trivia_request_duration_seconds_count{{{}}} '
+                             '{}'.format(labels, stats.count))
+
+            for name, attribute, type, help in (
+                    ('trivia_request_db_seconds_total', 'db_time', 'counter',
+                     'Time spent executing queries'),
+                    ('trivia_request_queries_total', 'queries', 'counter',
+                     'Queries executed'),
+                    ('trivia_request_rows_total', 'rows', 'counter',
+                     'Rows fetched or affected by queries')):
+                metric(name, type, help)
+                for (endpoint, method), stats in endpoints:
+                    lines.append('{}{{endpoint="{}",method="{}"}} {}'.format(
+                        name, endpoint, method, getattr(stats, attribute)))
+
+        metric('trivia_db_pool', 'gauge',
+               'Database connection pool status and checkout statistics')
+        for name, value in sorted(get_pool_status().items()):
+            if isinstance(value, (int, float)):
+                lines.append('trivia_db_pool{{stat="{}"}} {}'.format(
+                    name, value))
+
+        metric('trivia_search_cache', 'gauge',
+               'Search result cache size and hit, miss, eviction counts')
+        for name, value in sorted(search_cache.format().items()):
+            lines.append('trivia_search_cache{{stat="{}"}} {}'.format(
+                name, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    start = conn.info['query_start_time'].pop()
+    if has_request_context() and 'request_start_time' in g:
+        g.db_time += time.perf_counter() - start
+        g.query_count += 1
+        # rowcount is -1 when driver does not know it (server-side cursors)
+        g.row_count += max(cursor.rowcount, 0)
+
+
+@event.listens_for(Engine, 'handle_error')
+def handle_cursor_error(context):
+    start_times = context.connection.info.get('query_start_time')
+    if start_times:
+        start_times.pop()
+
+
+def is_profiling_requested(app):
+    if not app.config.get('PROFILING_ENABLED', False):
+        return False
+    return request.args.get('profile') == '1' or \
+        request.headers.get('X-Profile') == '1'
+
+
+# Profilers are imported when a request is profiled, not on app startup
+
+
+def render_profile(profiler):
+    if is_pyinstrument(profiler):
+        return profiler.output_text()
+    import io
+    import pstats
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats(
+        'cumulative').print_stats(50)
+    return output.getvalue()
+
+
+def is_pyinstrument(profiler):
+    return hasattr(profiler, 'output_text')
+
+
+def start_profiler(app):
+    if app.config.get('PROFILER', 'cprofile') == 'pyinstrument':
+        # Optional dependency, only needed when configured
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler):
+    if is_pyinstrument(profiler):
+        profiler.stop()
+    else:
+        profiler.disable()
+
+
+def init_metrics(app):
+    '''
+    Installs request instrumentation on app. With METRICS_HEADER config
+    every response carries Server-Timing and X-Query-Count headers. With
+    PROFILING_ENABLED config a request with `profile=1` query param or
+    `X-Profile: 1` header is run under profiler (cProfile, or pyinstrument
+    with PROFILER=pyinstrument) and responds with the profile instead.
+    '''
+    metrics = RequestMetrics()
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_start_time = time.perf_counter()
+        g.db_time = 0.0
+        g.query_count = 0
+        g.row_count = 0
+        if is_profiling_requested(app):
+            g.profiler = start_profiler(app)
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_start_time' not in g:
+            return response
+
+        duration = time.perf_counter() - g.request_start_time
+        metrics.record(request.endpoint or 'unknown', request.method,
+                       response.status_code, duration, g.db_time,
+                       g.query_count, g.row_count)
+
+        if app.config.get('METRICS_HEADER', False):
+            response.headers['Server-Timing'] = \
+                'app;dur={:.2f}, db;dur={:.2f}'.format(
+                    duration * 1000, g.db_time * 1000)
+            response.headers['X-Query-Count'] = str(g.query_count)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            stop_profiler(profiler)
+            response = app.response_class(render_profile(profiler),
+                                          mimetype='text/plain')
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return app.response_class(metrics.render(),
+                                  mimetype='text/plain; version=0.0.4')
+
+    return metrics
@@ -0,0 +1,41 @@
+import random
+
+from models import Question, question_records, get_question_record
+
+# Number of random offset picks tried before falling back to scanning ids
+MAX_RANDOM_ATTEMPTS = 8
+ID_SCAN_BATCH_SIZE = 1000
+
+
+def pick_random_question(query, previous_questions):
+    '''
+    Picks random question from given query which is not one of the
+    previous questions, returned as QuestionRecord.
+
+    A random row is fetched with OFFSET and rejected if it was already
+    served, so neither the candidate set is loaded nor a NOT IN clause
+    built out of previous_questions. Once most of the candidates were
+    served, rejection keeps missing and remaining ids are found by
+    scanning only the id column.
+    '''
+    excluded = set(previous_questions or [])
+    total = query.count()
+    if total == 0:
+        return None
+
+    ordered = query.order_by(Question.id)
+    for _ in range(MAX_RANDOM_ATTEMPTS):
+        records = question_records(
+            ordered.offset(random.randrange(total)).limit(1))
+        if len(records) > 0 and records[0].id not in excluded:
+            return records[0]
+
+    remaining = [
+        row.id for row in
+        ordered.with_entities(Question.id).yield_per(ID_SCAN_BATCH_SIZE)
+        if row.id not in excluded
+    ]
+    if len(remaining) == 0:
+        return None
+
+    return get_question_record(random.choice(remaining))
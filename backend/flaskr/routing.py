@@ -0,0 +1,72 @@
+import math
+import os
+import time
+
+from flask import request
+
+from models import route_reads
+
+'''
+Read routing
+    GET requests and views decorated with read_only read from replicas,
+    other requests from the primary. With READ_YOUR_WRITES_SECONDS set, a
+    client that wrote something is pinned to the primary for that many
+    seconds through a cookie, so it sees its own writes while replicas
+    catch up.
+'''
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PRIMARY_COOKIE = 'trivia_primary_until'
+
+
+def read_only(view):
+    '''
+    Marks a view which does not write to the database, so it can read from
+    replicas even though it is not a GET.
+    '''
+    view.read_only = True
+    return view
+
+
+def parse_replica_urls(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [url.strip() for url in value.split(',') if url.strip()]
+    return list(value)
+
+
+def is_read_request(app):
+    view = app.view_functions.get(request.endpoint)
+    return request.method in READ_METHODS or \
+        getattr(view, 'read_only', False)
+
+
+def is_pinned_to_primary():
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def init_read_routing(app):
+    pinSeconds = float(app.config.get(
+        'READ_YOUR_WRITES_SECONDS',
+        os.environ.get('READ_YOUR_WRITES_SECONDS', 0)))
+
+    @app.before_request
+    def route_request_reads():
+        route_reads(is_read_request(app) and not is_pinned_to_primary())
+
+    @app.after_request
+    def pin_writer_to_primary(response):
+        if pinSeconds > 0 and response.status_code < 400 and \
+                not is_read_request(app):
+            response.set_cookie(PRIMARY_COOKIE,
+                                '{:.3f}'.format(time.time() + pinSeconds),
+                                max_age=int(math.ceil(pinSeconds)))
+        return response
+
+    @app.teardown_request
+    def route_reads_to_primary(exception=None):
+        route_reads(False)
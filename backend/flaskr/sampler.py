@@ -0,0 +1,346 @@
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+
+from models import Question, get_questions_version, on_questions_changed
+
+'''
+Quiz question sampler
+    keeps ids of all questions in memory, bucketed by (category_id,
+    difficulty), so quiz turns pick a question without querying the
+    table. Buckets are picked by weight through alias method tables and a
+    question uniformly within the bucket, both O(1). Buckets are updated
+    incrementally on Question.insert/delete and rebuilt from database
+    after other changes or once older than max_age (to pick up changes
+    made by other worker processes). Rebuilds scan the table outside the
+    lock, quiz turns are served from previous buckets meanwhile. With a
+    snapshot store set, buckets are the read-only id columns of the
+    current snapshot instead.
+'''
+
+MAX_RANDOM_ATTEMPTS = 16
+MAX_CACHED_TABLES = 256
+BUILD_BATCH_SIZE = 10000
+
+
+class AliasTable:
+    '''
+    Vose's alias method: samples index i with probability
+    weights[i] / sum(weights) in O(1) after O(n) setup.
+    '''
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = float(sum(weights))
+        scaled = [weight * count / total for weight in weights]
+        self.probabilities = [1.0] * count
+        self.aliases = list(range(count))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def sample(self, rng=random):
+        pos = rng.randrange(len(self.probabilities))
+        if rng.random() < self.probabilities[pos]:
+            return pos
+        return self.aliases[pos]
+
+
+class QuestionSampler:
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        # Held while buckets are rebuilt, so only one request scans table
+        self.build_lock = threading.Lock()
+        self.buckets = None
+        self.built_at = None
+        self.version = None
+        self.tables = OrderedDict()
+        self.snapshots = None
+        self.snapshot = None
+
+    def build(self):
+        '''
+        Rebuilds buckets from database. The table is scanned without
+        holding the lock, so quiz turns keep sampling old buckets
+        meanwhile.
+        '''
+        version = get_questions_version()
+        buckets = {}
+        rows = Question.query.with_entities(
+            Question.id, Question.category_id, Question.difficulty
+        ).yield_per(BUILD_BATCH_SIZE)
+        for id, category_id, difficulty in rows:
+            key = (category_id, difficulty)
+            if key not in buckets:
+                buckets[key] = array('l')
+            buckets[key].append(id)
+
+        with self.lock:
+            self.buckets = buckets
+            self.version = version
+            self.tables.clear()
+            # Questions changed while scanning, changes might be missing
+            # from buckets, so these are rebuilt on next use
+            self.built_at = time.monotonic() \
+                if version == get_questions_version() else None
+            return buckets
+
+    def invalidate(self):
+        with self.lock:
+            self.buckets = None
+            self.built_at = None
+            self.snapshot = None
+            self.tables.clear()
+
+    def is_fresh(self):
+        return self.buckets is not None and self.built_at is not None and \
+            time.monotonic() - self.built_at < self.max_age
+
+    def apply(self, version, change):
+        with self.lock:
+            # Snapshot buckets change only when a new snapshot is published
+            if self.buckets is None or self.snapshot is not None:
+                return
+            if change is None:
+                # Keep serving current buckets until rebuilt
+                self.built_at = None
+                return
+
+            action, id, category_id, difficulty = change
+            bucket = self.buckets.get((category_id, difficulty))
+            if action == 'insert':
+                if bucket is None:
+                    bucket = self.buckets[(category_id, difficulty)] = \
+                        array('l')
+                bucket.append(id)
+            elif bucket is not None and id in bucket:
+                bucket.remove(id)
+            self.version = version
+            self.tables.clear()
+
+    def get_buckets(self):
+        '''
+        Returns current buckets. Expired buckets are rebuilt by one
+        request, others get the expired ones until it is done; only when
+        there are none yet they wait for it.
+        '''
+        snapshot = None if self.snapshots is None else self.snapshots.get()
+        with self.lock:
+            if snapshot is not None:
+                if snapshot is not self.snapshot:
+                    self.buckets = snapshot.buckets
+                    self.snapshot = snapshot
+                    self.tables.clear()
+                return self.buckets
+            if self.snapshot is not None:
+                # Snapshot was dropped, rebuild from database
+                self.invalidate()
+            if self.is_fresh():
+                return self.buckets
+            stale = self.buckets
+
+        if stale is not None:
+            if not self.build_lock.acquire(blocking=False):
+                return stale
+        else:
+            self.build_lock.acquire()
+        try:
+            with self.lock:
+                # Rebuilt by another request while waiting
+                if self.is_fresh():
+                    return self.buckets
+            return self.build()
+        finally:
+            self.build_lock.release()
+
+    def get_table(self, categories, difficulties):
+        '''
+        Returns alias table over buckets matching categories weights
+        ({category_id: weight}, None for all categories weighted by
+        their size) and difficulties ((min, max), None for all), along
+        with the buckets themselves.
+        '''
+        key = (None if categories is None else
+               tuple(sorted(categories.items())), difficulties)
+        buckets = self.get_buckets()
+        with self.lock:
+            # Tables are cached only for buckets still current
+            current = buckets is self.buckets
+            cached = self.tables.get(key) if current else None
+            if cached is not None:
+                self.tables.move_to_end(key)
+                return cached
+
+            candidates = [
+                (category_id, bucket)
+                for (category_id, difficulty), bucket in buckets.items()
+                if len(bucket) > 0 and
+                (categories is None or categories.get(category_id, 0) > 0) and
+                (difficulties is None or difficulty is not None and
+                 difficulties[0] <= difficulty <= difficulties[1])
+            ]
+
+            sizes = {}
+            for category_id, bucket in candidates:
+                sizes[category_id] = sizes.get(category_id, 0) + len(bucket)
+            weights = [
+                len(bucket) if categories is None else
+                categories[category_id] * len(bucket) / sizes[category_id]
+                for category_id, bucket in candidates
+            ]
+
+            table = AliasTable(weights) if len(candidates) > 0 else None
+            cached = (table, [bucket for _, bucket in candidates])
+            if current:
+                self.tables[key] = cached
+                if len(self.tables) > MAX_CACHED_TABLES:
+                    self.tables.popitem(last=False)
+            return cached
+
+    def sample(self, categories=None, difficulties=None, excluded=(),
+               rng=random):
+        '''
+        Returns id of a random question not in excluded. Category is
+        picked by weight, question uniformly within matching difficulties.
+        Once most candidates are excluded, rejection keeps missing and
+        remaining candidates are picked from uniformly.
+        '''
+        table, buckets = self.get_table(categories, difficulties)
+        if table is None:
+            return None
+
+        with self.lock:
+            for _ in range(MAX_RANDOM_ATTEMPTS):
+                bucket = buckets[table.sample(rng)]
+                # Bucket might have been emptied since table was built
+                if len(bucket) == 0:
+                    continue
+                id = bucket[rng.randrange(len(bucket))]
+                if id not in excluded:
+                    return id
+
+            remaining = [
+                id for bucket in buckets for id in bucket
+                if id not in excluded
+            ]
+        if len(remaining) == 0:
+            return None
+        return rng.choice(remaining)
+
+    def candidates(self, categories=None, difficulties=None):
+        _, buckets = self.get_table(categories, difficulties)
+        with self.lock:
+            return [id for bucket in buckets for id in bucket]
+
+    def discard(self, id):
+        '''
+        Drops id of a question which turned out to be deleted by another
+        worker process.
+        '''
+        with self.lock:
+            if self.snapshot is not None:
+                return
+            for bucket in (self.buckets or {}).values():
+                if id in bucket:
+                    bucket.remove(id)
+                    self.tables.clear()
+                    return
+
+
+class RecentHistory:
+    '''
+    Remembers last served question ids per client, so clients do not get
+    repeats across quiz sessions. Least recently seen clients are
+    forgotten once max_clients are tracked.
+    '''
+
+    def __init__(self, size=100, max_clients=10000):
+        self.size = size
+        self.max_clients = max_clients
+        self.clients = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, client_id):
+        with self.lock:
+            recent = self.clients.get(client_id)
+            return set() if recent is None else set(recent)
+
+    def add(self, client_id, id):
+        with self.lock:
+            recent = self.clients.get(client_id)
+            if recent is None:
+                recent = self.clients[client_id] = deque(maxlen=self.size)
+            recent.append(id)
+            self.clients.move_to_end(client_id)
+            while len(self.clients) > self.max_clients:
+                self.clients.popitem(last=False)
+
+
+class FallbackQuestions:
+    '''
+    Keeps up to max_size most recently served quiz questions (as
+    QuestionRecords), to serve quiz turns from while the database pool is
+    saturated. Deleted questions are dropped, all are dropped after other
+    changes.
+    '''
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.records = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.records[record.id] = record
+            self.records.move_to_end(record.id)
+            while len(self.records) > self.max_size:
+                self.records.popitem(last=False)
+
+    def apply(self, version, change):
+        with self.lock:
+            if change is None:
+                self.records.clear()
+            elif change[0] == 'delete':
+                self.records.pop(change[1], None)
+
+    def sample(self, categories=None, difficulties=None, excluded=(),
+               rng=random):
+        '''
+        Returns random cached question matching categories (with weight
+        above 0) and difficulties which is not in excluded, None if there
+        is none. Category weights are not applied.
+        '''
+        with self.lock:
+            candidates = [
+                record for record in self.records.values()
+                if record.id not in excluded and
+                (categories is None or
+                 categories.get(record.category_id, 0) > 0) and
+                (difficulties is None or record.difficulty is not None and
+                 difficulties[0] <= record.difficulty <= difficulties[1])
+            ]
+        if len(candidates) == 0:
+            return None
+        return rng.choice(candidates)
+
+
+sampler = QuestionSampler()
+on_questions_changed(sampler.apply)
+
+fallback_questions = FallbackQuestions()
+on_questions_changed(fallback_questions.apply)
@@ -0,0 +1,217 @@
+import bisect
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import func
+
+from models import db, Question, SEARCH_CONFIG, format_questions, \
+    get_questions_version, on_questions_changed
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+'''
+InvertedIndex
+    pure python token -> question ids index. Used in place of Postgres
+    full text search for databases without it (SQLite/test environments).
+'''
+
+
+class InvertedIndex:
+
+    def __init__(self, rows, include_answers=False):
+        self.postings = defaultdict(dict)
+        for id, question, answer in rows:
+            tokens = tokenize(question)
+            if include_answers:
+                tokens += tokenize(answer)
+            for token in tokens:
+                frequencies = self.postings[token]
+                frequencies[id] = frequencies.get(id, 0) + 1
+        self.vocabulary = sorted(self.postings)
+
+    def matches(self, token):
+        '''
+        Returns {id: frequency} of questions containing a token starting
+        with given token, like `token:*` prefix match of tsquery.
+        '''
+        matched = {}
+        pos = bisect.bisect_left(self.vocabulary, token)
+        while (pos < len(self.vocabulary) and
+               self.vocabulary[pos].startswith(token)):
+            for id, frequency in self.postings[
+                    self.vocabulary[pos]].items():
+                matched[id] = matched.get(id, 0) + frequency
+            pos += 1
+        return matched
+
+    def search(self, tokens):
+        '''
+        Returns ids of questions matching all tokens, most relevant first.
+        '''
+        scores = None
+        for token in tokens:
+            matched = self.matches(token)
+            if scores is None:
+                scores = matched
+            else:
+                scores = {
+                    id: score + matched[id]
+                    for id, score in scores.items() if id in matched
+                }
+            if len(scores) == 0:
+                break
+
+        return sorted(scores or {}, key=lambda id: (-scores[id], id))
+
+
+_indexes = {}
+
+
+def get_inverted_index(include_answers):
+    version = get_questions_version()
+    cached = _indexes.get(include_answers)
+    if cached is None or cached[0] != version:
+        rows = Question.query.with_entities(
+            Question.id, Question.question, Question.answer)
+        cached = (version, InvertedIndex(rows, include_answers))
+        _indexes[include_answers] = cached
+    return cached[1]
+
+
+'''
+SearchCache
+    LRU of search results keyed by normalized search term (its tokens) and
+    page, holding total number of matches and ids of the page. Entries
+    expire after ttl seconds (to pick up changes made by other worker
+    processes), and the whole cache is dropped whenever questions change
+    in this process.
+'''
+
+
+class SearchCache:
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self.entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            # Questions changed while searching, do not cache stale result
+            if version != get_questions_version():
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self, version=None, change=None):
+        with self.lock:
+            self.entries.clear()
+
+    def format(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+search_cache = SearchCache()
+on_questions_changed(search_cache.clear)
+
+
+def search_document(include_answers):
+    document = func.coalesce(Question.question, '')
+    if include_answers:
+        document = document.op('||')(' ').op('||')(
+            func.coalesce(Question.answer, ''))
+    return func.to_tsvector(SEARCH_CONFIG, document)
+
+
+def format_questions_by_ids(ids):
+    '''
+    Serializes questions with given ids, in the order of ids.
+    '''
+    if len(ids) == 0:
+        return []
+    questions = format_questions(Question.query.filter(Question.id.in_(ids)))
+    positions = {id: pos for pos, id in enumerate(ids)}
+    questions.sort(key=lambda question: positions[question['id']])
+    return questions
+
+
+def search_questions_page(searchTerm, page, size, include_answers=False):
+    '''
+    Searches questions for searchTerm and returns total number of matches
+    along with serialized questions of requested page, most relevant
+    first. Every word of searchTerm has to prefix match a word of the
+    question (or the answer, if include_answers is set). Results are
+    cached in search_cache.
+    '''
+    tokens = tokenize(searchTerm)
+    key = (' '.join(tokens), page, size, include_answers)
+    cached = search_cache.get(key)
+    if cached is not None:
+        total, ids = cached
+        return total, format_questions_by_ids(ids)
+
+    version = get_questions_version()
+    total, questions = find_questions_page(tokens, page, size,
+                                           include_answers)
+    search_cache.put(
+        key, (total, [question['id'] for question in questions]), version)
+    return total, questions
+
+
+def find_questions_page(tokens, page, size, include_answers):
+    offset = size * (page - 1)
+
+    if len(tokens) == 0:
+        query = Question.query
+        return query.count(), format_questions(
+            query.order_by(Question.id).limit(size).offset(offset))
+
+    if db.engine.dialect.name == 'postgresql':
+        document = search_document(include_answers)
+        tsquery = func.to_tsquery(
+            SEARCH_CONFIG, ' & '.join(token + ':*' for token in tokens))
+        query = Question.query.filter(document.op('@@')(tsquery))
+        return query.count(), format_questions(query.order_by(
+            func.ts_rank(document, tsquery).desc(),
+            Question.id).limit(size).offset(offset))
+
+    ids = get_inverted_index(include_answers).search(tokens)
+    return len(ids), format_questions_by_ids(ids[offset:offset + size])
@@ -0,0 +1,81 @@
+import json
+
+from flask import current_app
+
+from models import parse_bool
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+JSON providers
+    serialize response bodies straight to bytes. orjson is used when it
+    is installed, stdlib json otherwise. Output is compact unless
+    JSON_PRETTY is set; dumps_compact() is always compact, for streamed
+    responses which are assembled from fragments.
+'''
+
+
+class StdlibJSONProvider:
+    name = 'json'
+
+    def __init__(self, pretty=False):
+        self.pretty = pretty
+
+    def dumps(self, obj):
+        if self.pretty:
+            return json.dumps(obj, indent=2, ensure_ascii=False).encode(
+                'utf-8')
+        return self.dumps_compact(obj)
+
+    def dumps_compact(self, obj):
+        return json.dumps(obj, separators=(',', ':'),
+                          ensure_ascii=False).encode('utf-8')
+
+
+class OrjsonProvider:
+    name = 'orjson'
+
+    def __init__(self, pretty=False):
+        self.option = orjson.OPT_NON_STR_KEYS
+        self.pretty_option = self.option | orjson.OPT_INDENT_2
+        self.pretty = pretty
+
+    def dumps(self, obj):
+        return orjson.dumps(
+            obj, option=self.pretty_option if self.pretty else self.option)
+
+    def dumps_compact(self, obj):
+        return orjson.dumps(obj, option=self.option)
+
+
+def create_json_provider(config):
+    provider = config.get('JSON_PROVIDER', 'auto')
+    pretty = parse_bool(config.get('JSON_PRETTY', False))
+    if provider == 'auto':
+        provider = 'json' if orjson is None else 'orjson'
+
+    if provider == 'orjson':
+        if orjson is None:
+            raise RuntimeError('JSON_PROVIDER=orjson requires orjson package')
+        return OrjsonProvider(pretty)
+    if provider == 'json':
+        return StdlibJSONProvider(pretty)
+    raise ValueError('Unknown JSON_PROVIDER {}'.format(provider))
+
+
+def get_json_provider():
+    return current_app.extensions['json_provider']
+
+
+def jsonify(*args, **kwargs):
+    '''
+    Drop-in replacement of flask.jsonify using app's JSON provider.
+    '''
+    if args and kwargs:
+        raise TypeError('jsonify() takes either args or kwargs, not both')
+    data = args[0] if len(args) == 1 else (args or kwargs)
+    return current_app.response_class(
+        get_json_provider().dumps(data), mimetype='application/json')
@@ -0,0 +1,130 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+'''
+Quiz session stores
+    keep pre-shuffled question ids of server side quiz sessions, so every
+    quiz turn is an O(1) pop instead of a query excluding all previous
+    questions. Stores evict sessions not used for `ttl` seconds.
+
+    Store interface:
+        create(ids) -> session_id
+        pop(session_id) -> next question id, None once session is exhausted
+        delete(session_id)
+    pop raises SessionNotFound for unknown or expired sessions.
+'''
+
+
+class SessionNotFound(KeyError):
+    pass
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+class MemorySessionStore:
+    '''
+    In-process LRU store. Once max_sessions are live, least recently used
+    session is evicted. Sessions are local to a worker process, so run
+    single worker (or sticky sessions) with it, or use RedisSessionStore.
+    '''
+
+    def __init__(self, ttl=3600, max_sessions=10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def create(self, ids):
+        session_id = new_session_id()
+        # ids are popped from the end
+        remaining = list(reversed(ids))
+        with self.lock:
+            self.sessions[session_id] = (time.monotonic() + self.ttl,
+                                         remaining)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return session_id
+
+    def pop(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise SessionNotFound(session_id)
+            expires_at, remaining = session
+            if expires_at < now:
+                del self.sessions[session_id]
+                raise SessionNotFound(session_id)
+
+            self.sessions[session_id] = (now + self.ttl, remaining)
+            self.sessions.move_to_end(session_id)
+            return remaining.pop() if len(remaining) > 0 else None
+
+    def delete(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class RedisSessionStore:
+    '''
+    Store shared by all workers, backed by Redis (or anything providing
+    the same list commands). Remaining ids are kept in a Redis list next
+    to a marker key, as Redis drops lists once they are empty.
+    '''
+
+    def __init__(self, client, ttl=3600, prefix='trivia:quiz:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def keys(self, session_id):
+        key = self.prefix + session_id
+        return key, key + ':ids'
+
+    def create(self, ids):
+        session_id = new_session_id()
+        marker, ids_key = self.keys(session_id)
+        pipeline = self.client.pipeline()
+        pipeline.set(marker, 1, ex=self.ttl)
+        if len(ids) > 0:
+            pipeline.rpush(ids_key, *ids)
+            pipeline.expire(ids_key, self.ttl)
+        pipeline.execute()
+        return session_id
+
+    def pop(self, session_id):
+        marker, ids_key = self.keys(session_id)
+        pipeline = self.client.pipeline()
+        pipeline.expire(marker, self.ttl)
+        pipeline.lpop(ids_key)
+        pipeline.expire(ids_key, self.ttl)
+        exists, id, _ = pipeline.execute()
+        if not exists:
+            raise SessionNotFound(session_id)
+        return None if id is None else int(id)
+
+    def delete(self, session_id):
+        self.client.delete(*self.keys(session_id))
+
+
+def create_session_store(config):
+    ttl = int(config.get('QUIZ_SESSION_TTL', 3600))
+    store = config.get('QUIZ_SESSION_STORE', 'memory')
+    if store == 'memory':
+        return MemorySessionStore(
+            ttl, int(config.get('QUIZ_SESSION_MAX', 10000)))
+    if store == 'redis':
+        # Optional dependency, only needed when redis store is configured
+        import redis
+        return RedisSessionStore(
+            redis.Redis.from_url(config.get(
+                'QUIZ_SESSION_REDIS_URL', 'redis://localhost:6379/0')),
+            ttl)
+    raise ValueError('Unknown QUIZ_SESSION_STORE {}'.format(store))
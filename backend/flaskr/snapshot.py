@@ -0,0 +1,324 @@
+import binascii
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+
+from sqlalchemy import select
+
+from models import db, Question, Category, QuestionRecord, format_categories
+
+'''
+Question bank snapshots
+    read-only copy of questions and categories tables in a compact
+    columnar file, published with `flask export-snapshot`. Workers mmap
+    the file, so all of them share one copy in the page cache instead of
+    each caching the bank on its own heap.
+
+    Layout: header, table of section (offset, length) pairs, sections.
+    Ids are int64 arrays, category ids and difficulties int32 arrays (-1
+    for NULL), strings are utf-8 blobs indexed by uint64 offset arrays.
+    Questions are stored in id order. Extra sections index positions of
+    questions by category and ids by (category, difficulty) bucket, for
+    listing by category and for the quiz sampler.
+
+    Snapshots are written to a temporary file and renamed over the
+    published one, so readers never see a partial file. SnapshotStore
+    notices the rename and swaps to the new file.
+'''
+
+MAGIC = b'TRVSNAP1'
+HEADER = struct.Struct('<8s1sxxxIIII')
+SECTION = struct.Struct('<QQ')
+SECTIONS = (
+    'ids', 'category_ids', 'difficulties',
+    'question_offsets', 'questions', 'answer_offsets', 'answers',
+    'categories', 'category_type_offsets', 'category_types',
+    'category_positions', 'category_starts',
+    'bucket_ids', 'bucket_keys', 'version'
+)
+BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+NULL = -1
+EXPORT_BATCH_SIZE = 10000
+
+
+def to_column(value):
+    return NULL if value is None else value
+
+
+def from_column(value):
+    return None if value == NULL else value
+
+
+def strings_column(values):
+    '''
+    Returns (offsets, blob) of utf-8 encoded values, value i spanning
+    blob[offsets[i]:offsets[i + 1]].
+    '''
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for value in values:
+        blob += (value or '').encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, blob
+
+
+def write_snapshot(path):
+    '''
+    Exports questions and categories tables to a snapshot at path and
+    publishes it atomically. Returns snapshot version.
+    '''
+    ids = array('q')
+    category_ids = array('i')
+    difficulties = array('i')
+    questions = []
+    answers = []
+    table = Question.__table__
+    result = db.session.execute(select([
+        table.c.id, table.c.question, table.c.answer, table.c.category_id,
+        table.c.difficulty
+    ]).order_by(table.c.id))
+    while True:
+        rows = result.fetchmany(EXPORT_BATCH_SIZE)
+        if len(rows) == 0:
+            break
+        for id, question, answer, category_id, difficulty in rows:
+            ids.append(id)
+            category_ids.append(to_column(category_id))
+            difficulties.append(to_column(difficulty))
+            questions.append(question)
+            answers.append(answer)
+
+    table = Category.__table__
+    categories = db.session.execute(
+        select([table.c.id, table.c.type]).order_by(table.c.id)).fetchall()
+
+    positions = {id: array('i') for id, _ in categories}
+    buckets = {}
+    for pos, id in enumerate(ids):
+        category_id = category_ids[pos]
+        if category_id in positions:
+            positions[category_id].append(pos)
+        key = (category_id, difficulties[pos])
+        if key not in buckets:
+            buckets[key] = array('q')
+        buckets[key].append(id)
+
+    category_positions = array('i')
+    category_starts = array('Q', [0])
+    for id, _ in categories:
+        category_positions += positions[id]
+        category_starts.append(len(category_positions))
+
+    bucket_ids = array('q')
+    bucket_keys = array('q')
+    for key in sorted(buckets):
+        bucket_keys.extend(key)
+        bucket_keys.append(len(bucket_ids))
+        bucket_ids += buckets[key]
+        bucket_keys.append(len(bucket_ids))
+
+    question_offsets, question_blob = strings_column(questions)
+    answer_offsets, answer_blob = strings_column(answers)
+    type_offsets, type_blob = strings_column(type for _, type in categories)
+    version = '{}.{}'.format(int(time.time()),
+                             binascii.hexlify(os.urandom(4)).decode('ascii'))
+
+    sections = [
+        ids, category_ids, difficulties,
+        question_offsets, question_blob, answer_offsets, answer_blob,
+        array('q', [id for id, _ in categories]), type_offsets, type_blob,
+        category_positions, category_starts,
+        bucket_ids, bucket_keys, version.encode('ascii')
+    ]
+    header = HEADER.pack(MAGIC, BYTE_ORDER, len(ids), len(categories),
+                         len(bucket_keys) // 4, len(sections))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory,
+                                             prefix='.snapshot-')
+    try:
+        with os.fdopen(descriptor, 'wb') as output:
+            offset = HEADER.size + SECTION.size * len(sections)
+            table = []
+            for section in sections:
+                data = bytes(section)
+                # 8 byte alignment, so sections can be cast to int64 views
+                offset += -offset % 8
+                table.append((offset, len(data)))
+                offset += len(data)
+
+            output.write(header)
+            for offset, length in table:
+                output.write(SECTION.pack(offset, length))
+            for (offset, _), section in zip(table, sections):
+                output.write(b'\0' * (offset - output.tell()))
+                output.write(bytes(section))
+            output.flush()
+            os.fsync(output.fileno())
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except Exception:
+        os.unlink(temporary)
+        raise
+    return version
+
+
+class Snapshot:
+    '''
+    Read-only view of a snapshot file. Columns are memoryviews of the
+    mapped file, nothing is copied to the heap but categories.
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self.map = mmap.mmap(snapshot_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        magic, byte_order, self.size, category_count, bucket_count, \
+            section_count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or section_count != len(SECTIONS):
+            raise ValueError('{} is not a question snapshot'.format(path))
+        if byte_order != BYTE_ORDER:
+            raise ValueError('{} was written on a machine with other byte '
+                             'order'.format(path))
+
+        view = memoryview(self.map)
+        self.sections = {}
+        for pos, name in enumerate(SECTIONS):
+            offset, length = SECTION.unpack_from(
+                self.map, HEADER.size + SECTION.size * pos)
+            self.sections[name] = view[offset:offset + length]
+
+        self.ids = self.column('ids', 'q')
+        self.category_ids = self.column('category_ids', 'i')
+        self.difficulties = self.column('difficulties', 'i')
+        self.question_offsets = self.column('question_offsets', 'Q')
+        self.answer_offsets = self.column('answer_offsets', 'Q')
+        self.category_positions = self.column('category_positions', 'i')
+        self.category_starts = self.column('category_starts', 'Q')
+        self.bucket_ids = self.column('bucket_ids', 'q')
+        self.version = self.sections['version'].tobytes().decode('ascii')
+
+        type_offsets = self.column('category_type_offsets', 'Q')
+        types = self.sections['category_types']
+        self.categories = {}
+        self.category_index = {}
+        for pos, id in enumerate(self.column('categories', 'q')):
+            self.categories[id] = types[
+                type_offsets[pos]:type_offsets[pos + 1]].tobytes().decode(
+                    'utf-8')
+            self.category_index[id] = pos
+        self.formatted_categories = format_categories(self.categories)
+
+        keys = self.column('bucket_keys', 'q')
+        self.buckets = {
+            (from_column(keys[pos]), from_column(keys[pos + 1])):
+            self.bucket_ids[keys[pos + 2]:keys[pos + 3]]
+            for pos in range(0, 4 * bucket_count, 4)
+        }
+
+    def column(self, name, typecode):
+        return self.sections[name].cast(typecode)
+
+    def string(self, name, offsets, pos):
+        return self.sections[name][
+            offsets[pos]:offsets[pos + 1]].tobytes().decode('utf-8')
+
+    def record(self, pos):
+        return QuestionRecord(
+            self.ids[pos],
+            self.string('questions', self.question_offsets, pos),
+            self.string('answers', self.answer_offsets, pos),
+            from_column(self.category_ids[pos]),
+            from_column(self.difficulties[pos]))
+
+    def positions(self, category_id=None):
+        '''
+        Returns positions of questions of category (all questions for
+        None), in id order.
+        '''
+        if category_id is None:
+            return range(self.size)
+        pos = self.category_index.get(category_id)
+        if pos is None:
+            return range(0)
+        return self.category_positions[
+            self.category_starts[pos]:self.category_starts[pos + 1]]
+
+    def count(self, category_id=None):
+        return len(self.positions(category_id))
+
+    def get(self, id):
+        pos = self.search(range(self.size), id - 1)
+        if pos < self.size and self.ids[pos] == id:
+            return self.record(pos)
+        return None
+
+    def search(self, positions, after_id):
+        '''
+        Returns index of first of positions holding an id above after_id.
+        '''
+        low, high = 0, len(positions)
+        while low < high:
+            middle = (low + high) // 2
+            if self.ids[positions[middle]] <= after_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def page(self, category_id=None, offset=0, limit=10):
+        positions = self.positions(category_id)
+        return [self.record(pos) for pos in positions[offset:offset + limit]]
+
+    def page_after(self, category_id=None, after_id=0, limit=10):
+        positions = self.positions(category_id)
+        start = self.search(positions, after_id)
+        return [self.record(pos) for pos in positions[start:start + limit]]
+
+    def format(self, records):
+        return [record.format(self.formatted_categories)
+                for record in records]
+
+
+class SnapshotStore:
+    '''
+    Keeps the snapshot published at path open. At most every
+    check_interval seconds the path is checked for a newly published file,
+    which then replaces the current snapshot. Old snapshot is unmapped once
+    requests still reading it are done with it.
+    '''
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.file_id = None
+        self.checked_at = None
+
+    def get(self):
+        '''
+        Returns current snapshot, None while none is published.
+        '''
+        now = time.monotonic()
+        if self.checked_at is not None and \
+                now - self.checked_at < self.check_interval:
+            return self.snapshot
+
+        with self.lock:
+            self.checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self.snapshot = self.file_id = None
+                return None
+            file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if file_id != self.file_id:
+                self.snapshot = Snapshot(self.path)
+                self.file_id = file_id
+            return self.snapshot
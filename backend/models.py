@@ -1,28 +1,590 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine, ForeignKey
+from sqlalchemy import Column, String, Integer, create_engine, ForeignKey, \
+    Index, text, exc, func, event, select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy import orm
 from sqlalchemy.orm import relationship
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.pool import QueuePool, StaticPool
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+import itertools
+import logging
+import sqlite3
+import binascii
+import csv
+import io
 import json
+import threading
+import time
 
 database_name = "trivia"
 database_path = "postgres://{}@{}/{}".format(
     'postgres', 'localhost:5432', database_name)
 
-db = SQLAlchemy()
+logger = logging.getLogger(__name__)
+
+
+'''
+Read replicas
+    reads may be routed to replica databases, configured as SQLAlchemy
+    binds named replica0, replica1, ... by setup_db. A session routes
+    queries to the replica picked by route_reads() (round-robin over
+    healthy replicas) until route_reads(False); flushes always go to the
+    primary. A replica failing its health check or dropping connections
+    is skipped until it passes the check again, reads fall back to the
+    primary when no replica is healthy.
+'''
+
+REPLICA_CHECK_INTERVAL = 5
+
+
+class ReplicaRouter:
+
+    def __init__(self, check_interval=REPLICA_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.configure([])
+
+    def configure(self, engines):
+        with self.lock:
+            self.engines = list(engines)
+            self.healthy = {engine: True for engine in self.engines}
+            self.checked_at = {engine: 0.0 for engine in self.engines}
+            self.counter = itertools.count()
+        for engine in self.engines:
+            event.listen(engine, 'handle_error', self.on_error)
+
+    def on_error(self, context):
+        if context.is_disconnect:
+            self.mark_failed(context.engine)
+
+    def mark_failed(self, engine):
+        with self.lock:
+            if engine in self.healthy:
+                self.healthy[engine] = False
+                self.checked_at[engine] = time.monotonic()
+
+    def is_healthy(self, engine):
+        with self.lock:
+            if time.monotonic() - self.checked_at[engine] < \
+                    self.check_interval:
+                return self.healthy[engine]
+            # Concurrent requests keep the last result while this one checks
+            self.checked_at[engine] = time.monotonic()
+
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            healthy = True
+        except Exception:
+            logger.warning('Replica %s failed health check', engine.url,
+                           exc_info=True)
+            healthy = False
+        with self.lock:
+            self.healthy[engine] = healthy
+        return healthy
+
+    def choose(self):
+        '''
+        Returns next healthy replica engine, None when there is none.
+        '''
+        count = len(self.engines)
+        if count == 0:
+            return None
+        start = next(self.counter)
+        for pos in range(count):
+            engine = self.engines[(start + pos) % count]
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+    def format(self):
+        return [{
+            'url': repr(engine.url),
+            'healthy': self.is_healthy(engine)
+        } for engine in self.engines]
+
+
+replicas = ReplicaRouter()
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing:
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+def route_reads(enabled=True):
+    '''
+    Routes following queries of current session to a replica, or back to
+    the primary. Returns the replica engine, None when reading from the
+    primary.
+    '''
+    replica = replicas.choose() if enabled else None
+    if replica is None:
+        db.session.info.pop('replica', None)
+    else:
+        db.session.info['replica'] = replica
+    return replica
+
+
+def get_replica_status():
+    return replicas.format()
 
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. Reads can be
+    spread over replica_paths databases, see route_reads(). Does not touch
+    the database, schema is created by init_db() (`flask init-db`).
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_paths=()):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(
+        app, database_path)
+    app.config["SQLALCHEMY_BINDS"] = {
+        'replica{}'.format(pos): path
+        for pos, path in enumerate(replica_paths)
+    }
     db.app = app
     db.init_app(app)
-    db.create_all()
+    for bind in [None] + list(app.config["SQLALCHEMY_BINDS"]):
+        setup_sqlite_engine(db.get_engine(app, bind))
+    replicas.configure(
+        db.get_engine(app, bind) for bind in app.config["SQLALCHEMY_BINDS"])
+    _question_counts['max_age'] = float(app.config.get(
+        'QUESTION_COUNTS_MAX_AGE', os.environ.get(
+            'QUESTION_COUNTS_MAX_AGE', 60)))
+    _category_cache['max_age'] = float(app.config.get(
+        'CATEGORIES_MAX_AGE', os.environ.get('CATEGORIES_MAX_AGE', 60)))
+    invalidate_categories()
+    invalidate_questions()
+
+
+def init_db():
+    '''
+    Creates missing tables and applies pending migrations.
+    '''
+    # Replicas get their schema from the primary
+    db.create_all(bind=None)
+    migrate_db()
+
+
+'''
+Connection pool
+    pool sizing is read from app config (e.g. create_app(test_config)),
+    falling back to environment variables of the same name and then to
+    defaults below. Pool is instrumented to keep checkout/wait statistics,
+    see get_pool_status().
+'''
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+POOL_OPTIONS = {
+    'DB_POOL_SIZE': ('pool_size', int, 5),
+    'DB_MAX_OVERFLOW': ('max_overflow', int, 10),
+    'DB_POOL_TIMEOUT': ('pool_timeout', float, 30),
+    'DB_POOL_RECYCLE': ('pool_recycle', int, 1800),
+    'DB_POOL_PRE_PING': ('pool_pre_ping', parse_bool, True),
+}
+
+# SQLite does not use a queue pool, so sizing options do not apply to it
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+class PoolStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def record_checkout(self, wait_time, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            # Checkouts served straight from the pool take microseconds
+            if wait_time >= 0.001:
+                self.waits += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def format(self):
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time_seconds': round(self.wait_time, 6),
+                'max_wait_time_seconds': round(self.max_wait_time, 6),
+                'timeouts': self.timeouts
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_checkout(time.perf_counter() - start, True)
+            raise
+        pool_stats.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+def get_engine_options(app, database_path):
+    options = {}
+    for key, (option, parse, default) in POOL_OPTIONS.items():
+        value = app.config.get(key, os.environ.get(key))
+        options[option] = default if value is None else parse(value)
+
+    if make_url(database_path).get_backend_name() == 'sqlite':
+        for option in QUEUE_POOL_OPTIONS:
+            options.pop(option)
+        if is_memory_database(database_path):
+            options['poolclass'] = StaticPool
+            options['creator'] = lambda: get_memory_connection(
+                database_path)
+    else:
+        options['poolclass'] = InstrumentedQueuePool
+    return options
+
+
+'''
+SQLite
+    in-memory databases (`sqlite://`, e.g. for tests) live as long as
+    their connection. All engines of the process using the same in-memory
+    URL share a single connection, so every app and thread sees the same
+    database. pysqlite's own transaction handling is turned off in favour
+    of SQLAlchemy's, otherwise SAVEPOINTs do not work.
+'''
+
+_memory_connections = {}
+_memory_connections_lock = threading.Lock()
+
+
+def is_memory_database(database_path):
+    url = make_url(database_path)
+    return url.get_backend_name() == 'sqlite' and \
+        url.database in (None, '', ':memory:')
+
+
+def get_memory_connection(database_path):
+    with _memory_connections_lock:
+        connection = _memory_connections.get(database_path)
+        if connection is None:
+            connection = sqlite3.connect(':memory:', check_same_thread=False)
+            _memory_connections[database_path] = connection
+        return connection
+
+
+def disable_pysqlite_transactions(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def begin_sqlite_transaction(connection):
+    connection.execute('BEGIN')
+
+
+def setup_sqlite_engine(engine):
+    if engine.dialect.name != 'sqlite' or \
+            event.contains(engine, 'begin', begin_sqlite_transaction):
+        return
+    event.listen(engine, 'connect', disable_pysqlite_transactions)
+    event.listen(engine, 'begin', begin_sqlite_transaction)
+
+
+def get_pool_status():
+    pool = db.engine.pool
+    status = {
+        'pool': type(pool).__name__
+    }
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow()
+        })
+    status.update(pool_stats.format())
+    return status
+
+
+def is_pool_saturated():
+    '''
+    Whether every connection of the pool current session reads from (the
+    chosen replica or the primary) is checked out, so the next checkout
+    would wait for one to be returned.
+    '''
+    pool = (db.session.info.get('replica') or db.engine).pool
+    # max_overflow -1 means no limit
+    if not isinstance(pool, QueuePool) or pool._max_overflow < 0:
+        return False
+    return pool.checkedout() >= pool.size() + pool._max_overflow
+
+
+'''
+migrate_db()
+    db.create_all() only creates missing tables and never alters existing
+    ones. Schema changes for already deployed databases are listed in
+    MIGRATIONS, each one is applied once and recorded in schema_migrations
+    table. Migrations have to be idempotent, as on a fresh database
+    create_all() has already created everything declared on the models.
+'''
+
+SEARCH_CONFIG = 'english'
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    Column('version', Integer, primary_key=True),
+    Column('description', String))
+
+
+def create_search_indexes(connection):
+    '''
+    GIN indexes over full text search documents used by
+    POST /api/questions/search. Expressions have to match the ones built
+    by flaskr.search.search_document() for the planner to use them.
+    '''
+    if connection.dialect.name != 'postgresql':
+        return
+
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS questions_question_search_idx "
+        "ON questions USING GIN (to_tsvector('{0}', "
+        "COALESCE(question, '')))".format(SEARCH_CONFIG)))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS questions_question_answer_search_idx "
+        "ON questions USING GIN (to_tsvector('{0}', "
+        "COALESCE(question, '') || ' ' || COALESCE(answer, '')))".format(
+            SEARCH_CONFIG)))
+
+
+def create_category_indexes(connection):
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS questions_category_id_id_idx "
+        "ON questions (category_id, id)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS questions_category_id_difficulty_id_idx "
+        "ON questions (category_id, difficulty, id)"))
+
+
+MIGRATIONS = [
+    (1, 'Full text search indexes on questions', create_search_indexes),
+    (2, 'Category and difficulty indexes on questions',
+     create_category_indexes),
+]
+
+
+def migrate_db():
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            # Serialize workers booting at the same time
+            connection.execute(text(
+                "SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))"))
+
+        applied = {
+            row.version
+            for row in connection.execute(schema_migrations.select())
+        }
+        for version, description, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            migrate(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, description=description))
+
+
+'''
+Category cache
+    versioned in-process cache of category id -> type map. Categories
+    almost never change, so map is loaded once and dropped whenever
+    Category.insert/update/delete run. Reloaded once older than
+    CATEGORIES_MAX_AGE seconds, to pick up categories changed by other
+    worker processes.
+'''
+
+_category_cache = {
+    'version': 0,
+    'categories': None,
+    'loaded_at': 0.0,
+    'max_age': 60.0
+}
+
+
+def get_categories_map():
+    categories = _category_cache['categories']
+    if categories is None or \
+            time.monotonic() - _category_cache['loaded_at'] >= \
+            _category_cache['max_age']:
+        version = _category_cache['version']
+        table = Category.__table__
+        categories = {
+            id: type for id, type in db.session.execute(
+                select([table.c.id, table.c.type]).order_by(table.c.id))
+        }
+        # Categories changed while loading, do not cache stale map
+        if version == _category_cache['version']:
+            _category_cache['categories'] = categories
+            _category_cache['loaded_at'] = time.monotonic()
+    return categories
+
+
+def invalidate_categories():
+    _category_cache['version'] += 1
+    _category_cache['categories'] = None
+    # Deleting category detaches its questions
+    reset_question_counts()
+
+
+'''
+Question version
+    counter bumped whenever Question.insert/update/delete run, so
+    in-process structures derived from questions know when to rebuild.
+    Listeners registered with on_questions_changed are called with the new
+    version and the change: ('insert' | 'delete', id, category_id,
+    difficulty) for single questions, None when changed questions are not
+    known (bulk writes, updates) and derived structures have to rebuild.
+'''
+
+_question_cache = {
+    'version': 0
+}
+
+_question_listeners = []
+
+
+def get_questions_version():
+    return _question_cache['version']
+
+
+def on_questions_changed(listener):
+    _question_listeners.append(listener)
+    return listener
+
+
+def invalidate_questions(change=None):
+    _question_cache['version'] += 1
+    for listener in _question_listeners:
+        listener(_question_cache['version'], change)
+
+
+'''
+Question counts
+    total number of questions and number of questions per category,
+    loaded with one GROUP BY query and then kept up to date by
+    Question.insert/delete, so page metadata does not need COUNT(*).
+    Reloaded once older than QUESTION_COUNTS_MAX_AGE seconds, to pick up
+    changes made by other worker processes.
+'''
+
+_question_counts = {
+    'total': None,
+    'categories': None,
+    'loaded_at': 0.0,
+    'max_age': 60.0
+}
+
+
+def reset_question_counts():
+    _question_counts['total'] = None
+    _question_counts['categories'] = None
+
+
+def count_questions(category_id=None):
+    if _question_counts['categories'] is None or \
+            time.monotonic() - _question_counts['loaded_at'] >= \
+            _question_counts['max_age']:
+        version = get_questions_version()
+        rows = db.session.query(
+            Question.category_id, func.count(Question.id)
+        ).group_by(Question.category_id).all()
+        categories = {category: count for category, count in rows}
+        # Questions changed while counting, do not cache stale counts
+        if version != get_questions_version():
+            return sum(categories.values()) if category_id is None \
+                else categories.get(category_id, 0)
+        _question_counts['categories'] = categories
+        _question_counts['total'] = sum(categories.values())
+        _question_counts['loaded_at'] = time.monotonic()
+
+    if category_id is None:
+        return _question_counts['total']
+    return _question_counts['categories'].get(category_id, 0)
+
+
+def update_question_counts(version, change):
+    categories = _question_counts['categories']
+    if categories is None:
+        return
+    if change is None:
+        reset_question_counts()
+        return
+
+    action, id, category_id, difficulty = change
+    delta = 1 if action == 'insert' else -1
+    categories[category_id] = categories.get(category_id, 0) + delta
+    _question_counts['total'] += delta
+
+
+on_questions_changed(update_question_counts)
+
+
+'''
+Data version
+    changes whenever categories or questions are changed through the
+    models. Prefixed with a token unique to the process, as counters start
+    over on restart. Used to derive HTTP ETags of read endpoints.
+'''
+
+DATA_VERSION_EPOCH = binascii.hexlify(os.urandom(4)).decode('ascii')
+
+
+def get_data_version():
+    return '{}.{}.{}'.format(DATA_VERSION_EPOCH,
+                             _category_cache['version'],
+                             _question_cache['version'])
+
+
+def format_category(category_id):
+    category_type = get_categories_map().get(category_id)
+    if category_type is None:
+        return None
+    return {
+        'id': category_id,
+        'type': category_type
+    }
 
 
 '''
@@ -33,6 +595,11 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('questions_category_id_id_idx', 'category_id', 'id'),
+        Index('questions_category_id_difficulty_id_idx',
+              'category_id', 'difficulty', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
@@ -50,13 +617,20 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        invalidate_questions(
+            ('insert', self.id, self.category_id, self.difficulty))
 
     def update(self):
         db.session.commit()
+        invalidate_questions()
 
     def delete(self):
-        db.session.delete(self)
+        change = ('delete', self.id, self.category_id, self.difficulty)
+        # Unlike session.delete(), tells whether the row still existed
+        deleted = Question.query.filter(Question.id == self.id).delete(
+            synchronize_session='evaluate')
         db.session.commit()
+        invalidate_questions(change if deleted > 0 else None)
 
     def format(self):
         return {
@@ -64,11 +638,198 @@ class Question(db.Model):
             'question': self.question,
             'answer': self.answer,
             'category_id': self.category_id,
-            'category': self.category.format(),
+            'category': format_category(self.category_id),
+            'difficulty': self.difficulty
+        }
+
+
+'''
+Read path
+    listings and quiz picks do not need ORM objects, which are reserved
+    for writes. Only plain columns are selected and executed as Core
+    statements, rows become QuestionRecords: no identity map,
+    instrumented attributes or relationship state, and category comes
+    from category cache instead of lazy loading.
+'''
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category_id', 'difficulty')
+
+
+class QuestionRecord:
+    __slots__ = QUESTION_FIELDS
+
+    def __init__(self, id, question, answer, category_id, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category_id = category_id
+        self.difficulty = difficulty
+
+    def format(self, categories=None):
+        '''
+        Same as Question.format(). Pass format_categories() result when
+        formatting many records, so they share category dicts.
+        '''
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            'category_id': self.category_id,
+            'category': format_category(self.category_id)
+            if categories is None else categories.get(self.category_id),
             'difficulty': self.difficulty
         }
 
 
+def question_rows(query):
+    return query.with_entities(
+        Question.id,
+        Question.question,
+        Question.answer,
+        Question.category_id,
+        Question.difficulty)
+
+
+def question_records(query):
+    '''
+    Loads questions of given ORM query as QuestionRecords, executing its
+    statement through Core.
+    '''
+    result = db.session.execute(question_rows(query).statement)
+    return [QuestionRecord(*row) for row in result.fetchall()]
+
+
+def get_question_record(id):
+    table = Question.__table__
+    row = db.session.execute(
+        select([table.c[field] for field in QUESTION_FIELDS]).where(
+            table.c.id == id)).first()
+    return None if row is None else QuestionRecord(*row)
+
+
+def format_categories(categories):
+    '''
+    Formats category map once, so questions of the same category share
+    one category dict instead of each building its own.
+    '''
+    return {
+        id: {
+            'id': id,
+            'type': type
+        } for id, type in categories.items()
+    }
+
+
+def format_question_row(row, categories):
+    id, question, answer, category_id, difficulty = row
+    return {
+        'id': id,
+        'question': question,
+        'answer': answer,
+        'category_id': category_id,
+        'category': categories.get(category_id),
+        'difficulty': difficulty
+    }
+
+
+def format_questions(query):
+    categories = format_categories(get_categories_map())
+    return [
+        record.format(categories) for record in question_records(query)
+    ]
+
+
+'''
+bulk_insert_questions(mappings)
+    inserts validated question mappings in a single transaction. Postgres
+    is loaded through COPY FROM STDIN (like trivia.psql seed), other
+    databases through batched bulk_insert_mappings.
+'''
+
+BULK_INSERT_BATCH_SIZE = 1000
+
+
+def copy_supported(connection):
+    if connection.dialect.name != 'postgresql':
+        return False
+    # COPY is not supported once psycopg2 runs in green (gevent) mode
+    extensions = connection.dialect.dbapi.extensions
+    return extensions.get_wait_callback() is None
+
+
+def bulk_insert_questions(mappings):
+    try:
+        connection = db.session.connection()
+        if copy_supported(connection):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for mapping in mappings:
+                writer.writerow([
+                    mapping['question'], mapping['answer'],
+                    mapping['difficulty'], mapping['category_id']])
+            buffer.seek(0)
+            cursor = connection.connection.cursor()
+            cursor.copy_expert(
+                'COPY questions (question, answer, difficulty, category_id) '
+                'FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.close()
+        else:
+            for start in range(0, len(mappings), BULK_INSERT_BATCH_SIZE):
+                db.session.bulk_insert_mappings(
+                    Question, mappings[start:start + BULK_INSERT_BATCH_SIZE])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_questions()
+    return len(mappings)
+
+
+'''
+Batch delete and update
+    run as one set-based statement and one transaction over questions
+    matching all of the given filters: ids, category_id, difficulty.
+    Return number of affected rows.
+'''
+
+
+def filter_questions(ids=None, category_id=None, difficulty=None):
+    query = Question.query
+    if ids is not None:
+        query = query.filter(Question.id.in_(ids))
+    if category_id is not None:
+        query = query.filter(Question.category_id == category_id)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    return query
+
+
+def delete_questions(ids=None, category_id=None, difficulty=None):
+    try:
+        deleted = filter_questions(ids, category_id, difficulty).delete(
+            synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_questions()
+    return deleted
+
+
+def update_questions_category(new_category_id, ids=None, category_id=None,
+                              difficulty=None):
+    try:
+        updated = filter_questions(ids, category_id, difficulty).update(
+            {Question.category_id: new_category_id},
+            synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_questions()
+    return updated
+
+
 '''
 Category
 '''
@@ -87,13 +848,16 @@ class Category(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        invalidate_categories()
 
     def update(self):
         db.session.commit()
+        invalidate_categories()
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        invalidate_categories()
 
     def format(self):
         return {
@@ -1,11 +1,71 @@
 import os
 import unittest
+import importlib.util
 import json
-from random import randint
-from flask_sqlalchemy import SQLAlchemy
+import tempfile
+import time
+from unittest import mock
+from random import randint, Random
+from sqlalchemy import event, inspect, create_engine, orm
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.search import InvertedIndex, SearchCache, search_cache
+from flaskr.sessions import MemorySessionStore, SessionNotFound
+from flaskr.sampler import AliasTable, RecentHistory, sampler
+from flaskr.admission import RateLimiter
+from flaskr.green import patch_psycopg, is_patched
+from flaskr.snapshot import Snapshot, write_snapshot
+from flaskr.serialization import StdlibJSONProvider, OrjsonProvider, orjson, \
+    create_json_provider
+from psycopg2 import extensions
+from models import init_db, Question, Category, MIGRATIONS, \
+    schema_migrations, db, get_questions_version, invalidate_questions, \
+    RoutingSession, is_pool_saturated
+
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+IS_POSTGRES = TEST_DATABASE_URL.startswith('postgres')
+_schema_created = []
+
+
+class TransactionFixture:
+    '''
+    Runs everything a test does through db.session inside one transaction
+    on a single connection, rolled back at the end of the test. Commits
+    only release a SAVEPOINT, which is restarted right away, so the schema
+    never has to be rebuilt between tests.
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+
+    def start(self):
+        self.connection = self.engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.session
+        db.session = orm.scoped_session(
+            self.create_session, scopefunc=self.session.registry.scopefunc)
+
+    def create_session(self):
+        session = RoutingSession(db, bind=self.connection, binds={})
+        session.begin_nested()
+        event.listen(session, 'after_transaction_end', self.restart_savepoint)
+        return session
+
+    def restart_savepoint(self, session, transaction):
+        if transaction.nested and not transaction._parent.nested:
+            session.expire_all()
+            session.begin_nested()
+
+    def stop(self):
+        if self.connection is None:
+            return
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
+        self.connection = None
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -13,28 +73,23 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.database_path = TEST_DATABASE_URL
+        self.app = create_app({'DATABASE_URL': self.database_path})
         self.ctx = self.app.app_context()
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgres://{}@{}/{}".format(
-            'postgres', 'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
 
         # binds the app to the current context
         self.ctx.push()
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.drop_all()
-            self.db.create_all()
+        self.db = db
+        if not _schema_created:
+            init_db()
+            _schema_created.append(True)
+        self.fixture = TransactionFixture(db.get_engine(self.app))
+        self.fixture.start()
 
     def tearDown(self):
         """Executed after reach test"""
-        with self.app.app_context():
-            self.db.session.remove()
-            self.db.drop_all()
+        self.fixture.stop()
         self.ctx.pop()
 
     def insert_questions_for_test(self, category, count=15):
@@ -43,20 +98,217 @@ class TriviaTestCase(unittest.TestCase):
             question = Question('Q%s' % i, 'A%s' %
                                 i, category.id, randint(1, 4))
             question.category = category
-            question.insert()
             questions.append(question)
+        db.session.add_all(questions)
+        db.session.commit()
+        invalidate_questions()
         return questions
 
     def delete_questions(self, questions=[]):
         for question in questions:
             question.delete()
 
+    def count_queries(self, request, status_code=200):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = self.db.get_engine(self.app)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            response = request()
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        self.assertEqual(response.status_code, status_code)
+        return len(statements)
+
     """
     DONE: TODO
     Write at least one test for each test for successful operation and
     for expected errors.
     """
 
+    def test_migrations_create_question_indexes(self):
+        engine = self.db.get_engine(self.app)
+        indexes = {
+            index['name']: index['column_names']
+            for index in inspect(engine).get_indexes('questions')
+        }
+        self.assertEqual(indexes['questions_category_id_id_idx'],
+                         ['category_id', 'id'])
+        self.assertEqual(indexes['questions_category_id_difficulty_id_idx'],
+                         ['category_id', 'difficulty', 'id'])
+
+        versions = [
+            row.version
+            for row in engine.execute(schema_migrations.select())
+        ]
+        self.assertEqual(sorted(versions),
+                         [version for version, _, _ in MIGRATIONS])
+
+    def test_pool_options_from_config(self):
+        app = create_app({'DB_POOL_SIZE': 3, 'DB_POOL_PRE_PING': 'false'})
+        options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 10)
+        self.assertFalse(options['pool_pre_ping'])
+
+    def test_reads_routed_to_replicas(self):
+        # Queries have to reach the databases of this app
+        self.fixture.stop()
+        directory = tempfile.mkdtemp()
+        primary = 'sqlite:///' + os.path.join(directory, 'primary.db')
+        replica = 'sqlite:///' + os.path.join(directory, 'replica.db')
+        # Replicated rows, plus one the primary does not have
+        for url in (primary, replica):
+            engine = create_engine(url)
+            db.metadata.create_all(engine)
+            engine.execute(Category.__table__.insert(),
+                           {'id': 1, 'type': 'Science'})
+        engine.execute(Question.__table__.insert(), {
+            'question': 'Replicated', 'answer': 'A', 'difficulty': 1,
+            'category_id': 1})
+
+        app = create_app({
+            'DATABASE_URL': primary,
+            'DATABASE_REPLICA_URLS': 'sqlite:////nonexistent/replica.db, ' +
+                                     replica,
+            'READ_YOUR_WRITES_SECONDS': 5
+        })
+        client = app.test_client()
+
+        def question_texts(client):
+            return [question['question'] for question in
+                    client.get('/api/questions').get_json()['questions']]
+
+        for _ in range(3):
+            self.assertEqual(question_texts(client), ['Replicated'])
+        response = client.post('/api/quizzes', json={
+            'previous_questions': [], 'quiz_category': None})
+        self.assertEqual(response.get_json()['question']['question'],
+                         'Replicated')
+        replicas = client.get('/api/health').get_json()['replicas']
+        self.assertEqual([replica['healthy'] for replica in replicas],
+                         [False, True])
+
+        response = client.post('/api/questions', json={
+            'question': 'Written', 'answer': 'A', 'difficulty': 1,
+            'category': 1})
+        self.assertIn('trivia_primary_until', response.headers['Set-Cookie'])
+        # The writer reads its own write, other clients read from replica
+        self.assertEqual(question_texts(client), ['Written'])
+        self.assertEqual(question_texts(app.test_client()), ['Replicated'])
+
+    def test_init_db_command_and_warm_up(self):
+        database_path = 'sqlite:///' + os.path.join(tempfile.mkdtemp(),
+                                                    'init.db')
+        app = create_app({
+            'DATABASE_URL': database_path,
+            'WARM_UP': 'true'
+        })
+        result = app.test_cli_runner().invoke(args=['init-db'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Database initialized', result.output)
+
+        self.assertIsNotNone(sampler.buckets)
+        startup = app.test_client().get('/api/health').get_json()['startup']
+        self.assertGreater(startup['seconds'], 0)
+        self.assertLessEqual(startup['warm_up_seconds'], startup['seconds'])
+
+        app = create_app({'DATABASE_URL': database_path})
+        self.assertIsNone(sampler.buckets)
+        self.assertIsNone(app.extensions['startup']['warm_up_seconds'])
+
+    @unittest.skipUnless(IS_POSTGRES, 'pool is instrumented on Postgres')
+    def test_health_reports_pool_status(self):
+        response = self.client().get('/api/health')
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['database'], 'ok')
+        self.assertEqual(data['pool']['pool'], 'InstrumentedQueuePool')
+        self.assertGreater(data['pool']['checkouts'], 0)
+
+    @unittest.skipUnless(IS_POSTGRES and importlib.util.find_spec('gevent'),
+                         'gevent is not installed or not on Postgres')
+    def test_gevent_mode_serves_and_bulk_inserts(self):
+        category = Category("Science")
+        category.insert()
+        patch_psycopg()
+        try:
+            self.assertTrue(is_patched())
+            response = self.client().post('/api/questions/bulk', json=[
+                {'question': 'Q1', 'answer': 'A1', 'difficulty': 1,
+                 'category': category.id}])
+            self.assertEqual(response.get_json()['inserted'], 1)
+            response = self.client().get(
+                '/api/categories/{}/questions'.format(category.id))
+            self.assertEqual(response.get_json()['total_questions'], 1)
+        finally:
+            extensions.set_wait_callback(None)
+
+        self.delete_questions(Question.query.filter(
+            Question.category_id == category.id).all())
+        category.delete()
+
+    def test_json_response_is_compact(self):
+        category = Category("Science")
+        category.insert()
+        response = self.client().get('/api/categories')
+        body = response.get_data(as_text=True)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertNotIn('\n', body)
+        self.assertIn('"{}":"Science"'.format(category.id), body)
+        category.delete()
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_json_providers_match(self):
+        data = {
+            'categories': {1: 'Science', 2: 'Art'},
+            'questions': [{'id': 1, 'question': 'Qué?', 'category': None}]
+        }
+        self.assertEqual(json.loads(StdlibJSONProvider().dumps(data)),
+                         json.loads(OrjsonProvider().dumps(data)))
+        self.assertEqual(
+            json.loads(OrjsonProvider(pretty=True).dumps(data)),
+            json.loads(OrjsonProvider().dumps_compact(data)))
+
+    def test_json_pretty_flag_parsed(self):
+        self.assertFalse(create_json_provider(
+            {'JSON_PROVIDER': 'json', 'JSON_PRETTY': 'false'}).pretty)
+        self.assertTrue(create_json_provider(
+            {'JSON_PROVIDER': 'json', 'JSON_PRETTY': 'true'}).pretty)
+
+    def test_metrics_endpoint(self):
+        self.client().get('/api/questions')
+        response = self.client().get('/metrics')
+        body = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('trivia_requests_total{endpoint="get_questions",'
+                      'method="GET",status="200"} 1', body)
+        self.assertIn('trivia_request_queries_total{endpoint="get_questions",'
+                      'method="GET"}', body)
+        self.assertIn('trivia_db_pool{stat="checkouts"}', body)
+
+    def test_metrics_header_and_profiler(self):
+        app = create_app({
+            'DATABASE_URL': self.database_path,
+            'METRICS_HEADER': True,
+            'PROFILING_ENABLED': True
+        })
+        client = app.test_client()
+        response = client.get('/api/categories')
+        self.assertIn('db;dur=', response.headers['Server-Timing'])
+        self.assertIn('X-Query-Count', response.headers)
+
+        response = client.get('/api/categories?profile=1')
+        self.assertEqual(response.mimetype, 'text/plain')
+        self.assertIn('function calls', response.get_data(as_text=True))
+
+        response = self.client().get('/api/categories?profile=1')
+        self.assertEqual(response.mimetype, 'application/json')
+
     def test_get_questions_no_records(self):
         response = self.client().get('/api/questions')
         data = response.get_json()
@@ -93,6 +345,192 @@ class TriviaTestCase(unittest.TestCase):
         self.delete_questions(questions)
         category.delete()
 
+    def test_get_questions_with_cursor(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category)
+
+        response = self.client().get('/api/questions')
+        data = response.get_json()
+        self.assertEqual(len(data['questions']), 10)
+        self.assertIsNotNone(data['next_cursor'])
+
+        response = self.client().get(
+            '/api/questions?cursor={}'.format(data['next_cursor']))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total_questions'], 15)
+        self.assertEqual([q['id'] for q in data['questions']],
+                         [q.id for q in questions[10:]])
+        self.assertIsNone(data['next_cursor'])
+
+        response = self.client().get(
+            '/api/questions?after_id={}'.format(questions[12].id))
+        data = response.get_json()
+        self.assertEqual(len(data['questions']), 2)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_get_questions_invalid_cursor(self):
+        response = self.client().get('/api/questions?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count_does_not_grow_with_questions(self):
+        category = Category("Science")
+        category.insert()
+        category_url = '/api/categories/{}/questions'.format(category.id)
+        endpoints = [
+            lambda: self.client().get('/api/questions'),
+            lambda: self.client().get(category_url),
+            lambda: self.client().post('/api/questions/search',
+                                       json={'searchTerm': 'Q'})
+        ]
+
+        questions = self.insert_questions_for_test(category, 2)
+        # warm up category and count caches
+        self.client().get('/api/categories')
+        for endpoint in endpoints:
+            endpoint()
+        counts = [self.count_queries(endpoint) for endpoint in endpoints]
+
+        questions += self.insert_questions_for_test(category, 13)
+        self.client().get('/api/categories')
+        for endpoint in endpoints:
+            endpoint()
+        self.assertEqual(
+            [self.count_queries(endpoint) for endpoint in endpoints], counts)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_get_questions_etag(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 3)
+
+        response = self.client().get('/api/questions')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertIn('Cache-Control', response.headers)
+
+        response = self.client().get('/api/questions',
+                                     headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(self.count_queries(
+            lambda: self.client().get('/api/questions',
+                                      headers={'If-None-Match': etag}),
+            status_code=304), 0)
+
+        response = self.client().get('/api/questions?after_id=0',
+                                     headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        questions += self.insert_questions_for_test(category, 1)
+        response = self.client().get('/api/questions',
+                                     headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_etag_expires_after_max_age(self):
+        client = create_app({
+            'DATABASE_URL': self.database_path,
+            'HTTP_ETAG_MAX_AGE': 30
+        }).test_client()
+        with mock.patch('flaskr.caching.time.time', return_value=3000):
+            etag = client.get('/api/categories').headers['ETag']
+        with mock.patch('flaskr.caching.time.time', return_value=3029):
+            response = client.get('/api/categories',
+                                  headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+        # Writes of other workers are picked up once the ETag expires
+        with mock.patch('flaskr.caching.time.time', return_value=3030):
+            response = client.get('/api/categories',
+                                  headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+
+    def test_question_counts_are_cached(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 3)
+        category_url = '/api/categories/{}/questions'.format(category.id)
+
+        total = self.client().get('/api/questions').get_json()[
+            'total_questions']
+        self.client().get(category_url)
+        # page query only, counts are served from cache
+        self.assertEqual(self.count_queries(
+            lambda: self.client().get('/api/questions?after_id=0')), 1)
+        self.assertEqual(self.count_queries(
+            lambda: self.client().get(category_url + '?after_id=0')), 1)
+
+        questions += self.insert_questions_for_test(category, 2)
+        response = self.client().get(category_url)
+        self.assertEqual(response.get_json()['total_questions'], 5)
+
+        questions.pop().delete()
+        response = self.client().get('/api/questions')
+        self.assertEqual(response.get_json()['total_questions'], total + 1)
+        response = self.client().get(category_url)
+        self.assertEqual(response.get_json()['total_questions'], 4)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_categories_reloaded_after_max_age(self):
+        client = create_app({
+            'DATABASE_URL': self.database_path,
+            'CATEGORIES_MAX_AGE': 30
+        }).test_client()
+        client.get('/api/categories')
+
+        # Added by another worker process, not seen by this one
+        result = db.session.execute(
+            Category.__table__.insert().values(type='Music'))
+        category_id = result.inserted_primary_key[0]
+        db.session.commit()
+        question = {'question': 'Q', 'answer': 'A', 'difficulty': 1,
+                    'category': category_id}
+        response = client.post('/api/questions', json=question)
+        self.assertEqual(response.status_code, 400)
+
+        now = time.monotonic()
+        with mock.patch('models.time.monotonic', return_value=now + 30):
+            response = client.post('/api/questions', json=question)
+            self.assertEqual(response.status_code, 200)
+            categories = client.get('/api/categories').get_json()[
+                'categories']
+            self.assertEqual(categories[str(category_id)], 'Music')
+
+    def test_question_counts_reloaded_after_max_age(self):
+        category = Category("Science")
+        category.insert()
+        self.insert_questions_for_test(category, 1)
+        category_id = category.id
+        client = create_app({
+            'DATABASE_URL': self.database_path,
+            'QUESTION_COUNTS_MAX_AGE': 30
+        }).test_client()
+        category_url = '/api/categories/{}/questions'.format(category_id)
+        self.assertEqual(
+            client.get(category_url).get_json()['total_questions'], 1)
+
+        # Inserted by another worker process, not seen by this one
+        db.session.execute(Question.__table__.insert().values(
+            question='Q', answer='A', category_id=category_id, difficulty=1))
+        db.session.commit()
+        self.assertEqual(
+            client.get(category_url).get_json()['total_questions'], 1)
+
+        now = time.monotonic()
+        with mock.patch('models.time.monotonic', return_value=now + 30):
+            self.assertEqual(
+                client.get(category_url).get_json()['total_questions'], 2)
+
     def test_get_questions_by_category_valid_category(self):
         category = Category("Science")
         category.insert()
@@ -107,6 +545,80 @@ class TriviaTestCase(unittest.TestCase):
         self.delete_questions(questions)
         category.delete()
 
+    def test_get_questions_by_category_pagination(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 15)
+        url = '/api/categories/{}/questions'.format(category.id)
+
+        response = self.client().get(url + '?page=2')
+        data = response.get_json()
+        self.assertEqual(data['total_questions'], 15)
+        self.assertEqual([q['id'] for q in data['questions']],
+                         [q.id for q in questions[10:]])
+
+        response = self.client().get(url + '?limit=4&after_id={}'.format(
+            questions[0].id))
+        data = response.get_json()
+        self.assertEqual([q['id'] for q in data['questions']],
+                         [q.id for q in questions[1:5]])
+        self.assertIsNotNone(data['next_cursor'])
+
+        response = self.client().get(url + '?limit=1000')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client().get(url + '?page=0')
+        self.assertEqual(response.status_code, 400)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_get_questions_by_category_page_past_last(self):
+        # Frontend keeps page of the main list when picking a category
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 3)
+        response = self.client().get(
+            '/api/categories/{}/questions?page=2'.format(category.id))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['questions'], [])
+        self.assertEqual(data['total_questions'], 3)
+        self.assertEqual(data['current_category'], category.id)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_get_questions_by_category_stream(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 15)
+        url = '/api/categories/{}/questions'.format(category.id)
+
+        response = self.client().get(url + '?stream=ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines],
+                         [q.id for q in questions])
+
+        response = self.client().get(url + '?stream=json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([q['id'] for q in response.get_json()],
+                         [q.id for q in questions])
+
+        response = self.client().get(url + '?stream=csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()),
+                         len(questions) + 1)
+
+        response = self.client().get(url + '?stream=xml')
+        self.assertEqual(response.status_code, 400)
+
+        self.delete_questions(questions)
+        category.delete()
+
     def test_get_questions_by_category_invalid_category(self):
         category = Category("Science")
         category.insert()
@@ -119,6 +631,28 @@ class TriviaTestCase(unittest.TestCase):
         self.delete_questions(questions)
         category.delete()
 
+    def test_get_categories_cache_invalidated_on_insert(self):
+        response = self.client().get('/api/categories')
+        total_categories = response.get_json()['total_categories']
+
+        category = Category("Science")
+        category.insert()
+        response = self.client().get('/api/categories')
+        data = response.get_json()
+        self.assertEqual(data['total_categories'], total_categories + 1)
+        self.assertEqual(data['categories'][str(category.id)], 'Science')
+
+        category.type = 'Art'
+        category.update()
+        response = self.client().get('/api/categories')
+        data = response.get_json()
+        self.assertEqual(data['categories'][str(category.id)], 'Art')
+
+        category.delete()
+        response = self.client().get('/api/categories')
+        data = response.get_json()
+        self.assertEqual(data['total_categories'], total_categories)
+
     def test_add_question_valid_payload(self):
         category = Category('Dummy')
         category.insert()
@@ -179,6 +713,371 @@ class TriviaTestCase(unittest.TestCase):
 
         category.delete()
 
+    def test_bulk_add_questions_json_ndjson_csv(self):
+        category = Category("Science")
+        category.insert()
+
+        response = self.client().post('/api/questions/bulk', json=[
+            {'question': 'Q1', 'answer': 'A1', 'difficulty': 1,
+             'category': category.id},
+            {'question': 'Q2', 'answer': 'A2', 'difficulty': 2,
+             'category': category.id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['inserted'], 2)
+
+        ndjson = '\n'.join(json.dumps({
+            'question': 'N%s' % i, 'answer': 'A', 'difficulty': 3,
+            'category': category.id}) for i in range(3))
+        response = self.client().post('/api/questions/bulk', data=ndjson,
+                                      content_type='application/x-ndjson')
+        self.assertEqual(response.get_json()['inserted'], 3)
+
+        data = 'question,answer,difficulty,category\n"C, 1",A,4,{}\n'.format(
+            category.id)
+        response = self.client().post('/api/questions/bulk', data=data,
+                                      content_type='text/csv')
+        self.assertEqual(response.get_json()['inserted'], 1)
+
+        questions = Question.query.filter(
+            Question.category_id == category.id).order_by(Question.id).all()
+        self.assertEqual([q.question for q in questions],
+                         ['Q1', 'Q2', 'N0', 'N1', 'N2', 'C, 1'])
+        response = self.client().get(
+            '/api/categories/{}/questions'.format(category.id))
+        self.assertEqual(response.get_json()['total_questions'], 6)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_bulk_add_questions_invalid_records(self):
+        category = Category("Science")
+        category.insert()
+
+        response = self.client().post('/api/questions/bulk', json=[
+            {'question': 'Q1', 'answer': 'A1', 'difficulty': 1,
+             'category': category.id},
+            {'question': '', 'answer': 'A2', 'difficulty': 2,
+             'category': category.id},
+            {'question': 'Q3', 'answer': 'A3', 'difficulty': 2,
+             'category': 0},
+        ])
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in data['errors']], [1, 2])
+        self.assertEqual(Question.query.filter(
+            Question.category_id == category.id).count(), 0)
+
+        response = self.client().post('/api/questions/bulk', data='[{',
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        for content_type in ('application/json', 'text/csv'):
+            response = self.client().post('/api/questions/bulk',
+                                          data=b'\xff\xfe[',
+                                          content_type=content_type)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Malformed', response.get_json()['details'])
+
+        category.delete()
+
+    def test_batch_delete_questions(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 6)
+        category_url = '/api/categories/{}/questions'.format(category.id)
+        self.client().get(category_url)
+
+        response = self.client().delete('/api/questions', json={
+            'ids': [question.id for question in questions[:2]]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['deleted'], 2)
+        self.assertEqual(self.client().get(category_url).get_json()[
+            'total_questions'], 4)
+
+        for question in questions[2:4]:
+            question.difficulty = 5
+            question.update()
+        response = self.client().delete('/api/questions', json={
+            'category': category.id, 'difficulty': 5})
+        self.assertEqual(response.get_json()['deleted'], 2)
+        self.assertEqual(Question.query.filter(
+            Question.category_id == category.id).count(), 2)
+
+        response = self.client().delete('/api/questions', json={})
+        self.assertEqual(response.status_code, 400)
+        response = self.client().delete('/api/questions',
+                                        json={'ids': ['1']})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client().delete('/api/questions', json={
+            'category': category.id})
+        self.assertEqual(response.get_json()['deleted'], 2)
+        category.delete()
+
+
+    def test_batch_delete_rejects_booleans(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 2)
+
+        for body in ({'ids': [True]}, {'category': True},
+                     {'difficulty': False}):
+            response = self.client().delete('/api/questions', json=body)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Question.query.filter(
+            Question.category_id == category.id).count(), 2)
+
+        self.delete_questions(questions)
+        category.delete()
+    def test_batch_update_questions_category(self):
+        category = Category("Science")
+        category.insert()
+        other = Category("Art")
+        other.insert()
+        questions = self.insert_questions_for_test(category, 4)
+        other_url = '/api/categories/{}/questions'.format(other.id)
+        self.client().get(other_url)
+
+        response = self.client().patch('/api/questions', json={
+            'ids': [question.id for question in questions[:3]],
+            'set': {'category': other.id}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['updated'], 3)
+        self.assertEqual(self.client().get(other_url).get_json()[
+            'total_questions'], 3)
+
+        response = self.client().patch('/api/questions', json={
+            'category': category.id, 'set': {'category': 0}})
+        self.assertEqual(response.status_code, 400)
+        response = self.client().patch('/api/questions', json={
+            'set': {'category': other.id}})
+        self.assertEqual(response.status_code, 400)
+
+        self.client().delete('/api/questions', json={
+            'ids': [question.id for question in questions]})
+        other.delete()
+        category.delete()
+
+    def test_snapshot_columns(self):
+        category = Category("Science")
+        category.insert()
+        other = Category("Art")
+        other.insert()
+        questions = [
+            Question('Q1', 'A1', category.id, 1),
+            Question('Q2', 'A2', other.id, 2),
+            Question('Q3', 'A3', category.id, 1),
+            Question('Q4', 'A4', category.id, 3),
+        ]
+        for question in questions:
+            question.insert()
+
+        path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+        version = write_snapshot(path)
+        snapshot = Snapshot(path)
+        self.assertEqual(snapshot.version, version)
+        self.assertEqual(snapshot.categories,
+                         {category.id: 'Science', other.id: 'Art'})
+        self.assertEqual(snapshot.count(), 4)
+        self.assertEqual(snapshot.count(category.id), 3)
+
+        record = snapshot.get(questions[0].id)
+        self.assertEqual(record.format(), questions[0].format())
+        self.assertIsNone(snapshot.get(questions[-1].id + 1))
+
+        self.assertEqual(
+            [record.id for record in snapshot.page(category.id, 1, 2)],
+            [questions[2].id, questions[3].id])
+        self.assertEqual(
+            [record.id for record in
+             snapshot.page_after(None, questions[1].id, 10)],
+            [questions[2].id, questions[3].id])
+        self.assertEqual(list(snapshot.buckets[(category.id, 1)]),
+                         [questions[0].id, questions[2].id])
+
+    def test_endpoints_served_from_snapshot(self):
+        category = Category("Science")
+        category.insert()
+        question = Question('Snapshot', 'A', category.id, 1)
+        question.insert()
+        path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+        write_snapshot(path)
+        category_id, question_id = category.id, question.id
+        expected = question.format()
+
+        app = create_app({
+            'DATABASE_URL': self.database_path,
+            'QUESTION_SNAPSHOT': path,
+            'QUESTION_SNAPSHOT_CHECK_INTERVAL': 0
+        })
+        client = app.test_client()
+        added = Question('Database only', 'A', category_id, 1)
+        added.insert()
+        added_id = added.id
+
+        response = client.get('/api/questions')
+        etag = response.headers['ETag']
+        self.assertEqual([q['question'] for q in
+                          response.get_json()['questions']], ['Snapshot'])
+        response = client.get(
+            '/api/categories/{}/questions'.format(category_id))
+        self.assertEqual(response.get_json()['total_questions'], 1)
+        response = client.post('/api/quizzes', json={
+            'previous_questions': [], 'quiz_category': category_id})
+        self.assertEqual(response.get_json()['question'], expected)
+        response = client.post('/api/quizzes', json={
+            'previous_questions': [question_id],
+            'quiz_category': category_id})
+        self.assertEqual(response.get_json(), {})
+
+        # Publishing a new snapshot swaps it in
+        write_snapshot(path)
+        response = client.get('/api/questions')
+        self.assertEqual(response.get_json()['total_questions'], 2)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        response = client.post('/api/quizzes', json={
+            'previous_questions': [question_id],
+            'quiz_category': category_id})
+        self.assertEqual(response.get_json()['question']['id'], added_id)
+
+        # App without snapshot does not keep sampling from it
+        create_app({'DATABASE_URL': self.database_path})
+        self.assertIsNone(sampler.snapshot)
+        self.assertEqual(len(sampler.tables), 0)
+        self.assertEqual(sampler.candidates({category_id: 1}),
+                         [question_id, added_id])
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=2, burst=2)
+        self.assertEqual(limiter.acquire('a', now=0), 0)
+        self.assertEqual(limiter.acquire('a', now=0), 0)
+        self.assertEqual(limiter.acquire('a', now=0), 0.5)
+        self.assertEqual(limiter.acquire('b', now=0), 0)
+        self.assertEqual(limiter.acquire('a', now=0.5), 0)
+
+    def test_quiz_rate_limited_per_client(self):
+        category = Category("Science")
+        category.insert()
+        self.insert_questions_for_test(category, 3)
+        client = create_app({
+            'DATABASE_URL': self.database_path,
+            'QUIZ_RATE_LIMIT': 0.1,
+            'QUIZ_RATE_BURST': 2,
+            'RATE_LIMIT_CLIENT_HEADER': 'X-Client-Id'
+        }).test_client()
+        body = {'previous_questions': [], 'quiz_category': None}
+
+        for _ in range(2):
+            response = client.post('/api/quizzes', json=body)
+            self.assertEqual(response.status_code, 200)
+        response = client.post('/api/quizzes', json=body)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.get_json()['error'], 'Too Many Requests')
+        self.assertEqual(response.headers['Retry-After'], '10')
+
+        response = client.post('/api/quizzes', json=body,
+                               headers={'X-Client-Id': 'other'})
+        self.assertEqual(response.status_code, 200)
+        response = client.post('/api/questions/search',
+                               json={'searchTerm': 'Q'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_search_concurrency_limited(self):
+        app = create_app({
+            'DATABASE_URL': self.database_path,
+            'SEARCH_MAX_CONCURRENCY': 1,
+            'ADMISSION_RETRY_AFTER': 2
+        })
+        client = app.test_client()
+        search = app.extensions['admission']['search']
+
+        # Slot is released once request is done
+        for _ in range(2):
+            response = client.post('/api/questions/search',
+                                   json={'searchTerm': 'Q'})
+            self.assertEqual(response.status_code, 200)
+
+        # Another request is in flight
+        self.assertTrue(search.concurrency.acquire())
+        response = client.post('/api/questions/search',
+                               json={'searchTerm': 'Q'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '2')
+        search.release()
+
+        stats = client.get('/api/health').get_json()['admission']['search']
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(stats['admitted'], 2)
+        self.assertEqual(stats['overloaded'], 1)
+
+    def test_degraded_quiz_served_from_memory(self):
+        category = Category("Science")
+        category.insert()
+        question = self.insert_questions_for_test(category, 1)[0]
+        body = {'previous_questions': [], 'quiz_category': category.id}
+        response = self.client().post('/api/quizzes', json=body)
+        self.assertEqual(response.get_json()['question']['id'], question.id)
+        self.assertNotIn('X-Degraded', response.headers)
+
+        with mock.patch('flaskr.is_pool_saturated', return_value=True):
+            queries = self.count_queries(
+                lambda: self.client().post('/api/quizzes', json=body))
+            self.assertEqual(queries, 0)
+            response = self.client().post('/api/quizzes', json=body)
+            self.assertEqual(response.headers['X-Degraded'], '1')
+            self.assertEqual(response.get_json()['question'],
+                             question.format())
+
+            body['previous_questions'] = [question.id]
+            response = self.client().post('/api/quizzes', json=body)
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+
+        # Deleted questions are not served anymore
+        body['previous_questions'] = []
+        question.delete()
+        with mock.patch('flaskr.is_pool_saturated', return_value=True):
+            response = self.client().post('/api/quizzes', json=body)
+            self.assertEqual(response.status_code, 503)
+
+    @unittest.skipUnless(IS_POSTGRES, 'pool is sized on Postgres')
+    def test_pool_saturation(self):
+        app = create_app({
+            'DATABASE_URL': self.database_path,
+            'DB_POOL_SIZE': 1,
+            'DB_MAX_OVERFLOW': 0
+        })
+        with app.app_context():
+            self.assertFalse(is_pool_saturated())
+            connection = db.get_engine(app).connect()
+            try:
+                self.assertTrue(is_pool_saturated())
+            finally:
+                connection.close()
+            self.assertFalse(is_pool_saturated())
+
+    def test_export_questions(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 3)
+
+        response = self.client().get('/api/questions/export?format=csv')
+        self.assertEqual(response.status_code, 200)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(lines[0], 'id,question,answer,difficulty,category')
+        self.assertIn('{},Q0,A0,{},{}'.format(
+            questions[0].id, questions[0].difficulty, category.id), lines)
+
+        response = self.client().get('/api/questions/export')
+        ids = [json.loads(line)['id']
+               for line in response.get_data(as_text=True).splitlines()]
+        for question in questions:
+            self.assertIn(question.id, ids)
+
+        self.delete_questions(questions)
+        category.delete()
+
     def test_search_questions_matching_word(self):
         category = Category("Science")
         category.insert()
@@ -211,6 +1110,109 @@ class TriviaTestCase(unittest.TestCase):
         question.delete()
         category.delete()
 
+    def test_search_questions_answers_and_prefix(self):
+        category = Category("Science")
+        category.insert()
+        questions = [
+            Question('Who moved my cheese', 'Not Me!', category.id, 1),
+            Question('Which cheese is blue', 'Gorgonzola', category.id, 1),
+        ]
+        for question in questions:
+            question.insert()
+
+        response = self.client().post('/api/questions/search',
+                                      json={'searchTerm': 'chee'})
+        data = response.get_json()
+        self.assertEqual(data['total_questions'], 2)
+
+        response = self.client().post('/api/questions/search',
+                                      json={'searchTerm': 'gorgonzola'})
+        data = response.get_json()
+        self.assertEqual(data['total_questions'], 0)
+
+        response = self.client().post('/api/questions/search', json={
+            'searchTerm': 'gorgonzola',
+            'searchAnswers': True
+        })
+        data = response.get_json()
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['id'], questions[1].id)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_search_questions_invalid_page(self):
+        response = self.client().post('/api/questions/search', json={
+            'searchTerm': 'cheese',
+            'page': 0
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_results_cached(self):
+        category = Category("Science")
+        category.insert()
+        questions = [
+            Question('Who moved my cheese', 'Not Me!', category.id, 1),
+            Question('Which cheese is blue', 'Gorgonzola', category.id, 1),
+        ]
+        for question in questions:
+            question.insert()
+
+        stats = search_cache.format()
+        self.client().post('/api/questions/search',
+                           json={'searchTerm': 'Cheese'})
+        # Same normalized term, served from cache with a single query
+        self.assertEqual(self.count_queries(
+            lambda: self.client().post('/api/questions/search',
+                                       json={'searchTerm': '  cheese '})), 1)
+        self.assertEqual(search_cache.format()['hits'], stats['hits'] + 1)
+        self.assertEqual(search_cache.format()['misses'],
+                         stats['misses'] + 1)
+
+        questions.pop().delete()
+        response = self.client().post('/api/questions/search',
+                                      json={'searchTerm': 'cheese'})
+        self.assertEqual(response.get_json()['total_questions'], 1)
+
+        response = self.client().get('/metrics')
+        self.assertIn('trivia_search_cache{stat="hits"}',
+                      response.get_data(as_text=True))
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_search_cache_evicts_least_recently_used(self):
+        cache = SearchCache(max_size=2, ttl=60)
+        version = get_questions_version()
+        cache.put('a', (1, [1]), version)
+        cache.put('b', (1, [2]), version)
+        self.assertEqual(cache.get('a'), (1, [1]))
+        cache.put('c', (1, [3]), version)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), (1, [3]))
+        self.assertEqual(cache.format()['evictions'], 1)
+
+        # Expired and stale results are not served
+        cache.ttl = -1
+        cache.put('c', (1, [3]), version)
+        self.assertIsNone(cache.get('c'))
+        cache.put('d', (0, []), version - 1)
+        self.assertEqual(cache.format()['size'], 1)
+
+    def test_inverted_index_search(self):
+        index = InvertedIndex([
+            (1, 'Who moved my cheese', 'Not Me!'),
+            (2, 'Cheese or cheesecake?', 'Cheesecake'),
+            (3, 'Where is TajMahal?', 'India'),
+        ])
+        self.assertEqual(index.search(['cheese']), [2, 1])
+        self.assertEqual(index.search(['who', 'chee']), [1])
+        self.assertEqual(index.search(['india']), [])
+
+        index = InvertedIndex([(3, 'Where is TajMahal?', 'India')],
+                              include_answers=True)
+        self.assertEqual(index.search(['india']), [3])
+
     def test_delete_question_valid_id(self):
         category = Category("Science")
         category.insert()
@@ -239,7 +1241,9 @@ class TriviaTestCase(unittest.TestCase):
         question.category = category
         question.insert()
 
-        response = self.client().delete('/api/questions/1')
+        # ids restart from 1 once test transaction is rolled back
+        response = self.client().delete(
+            '/api/questions/{}'.format(question.id + 1))
         data = response.get_json()
 
         self.assertEqual(response.status_code, 200)
@@ -310,6 +1314,257 @@ class TriviaTestCase(unittest.TestCase):
         question.delete()
         category.delete()
 
+    def test_get_random_question_skips_previous_questions(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 15)
+
+        remaining = questions[7]
+        previous_questions = [
+            question.id for question in questions if question is not remaining
+        ]
+        response = self.client().post('/api/quizzes', json={
+            'previous_questions': previous_questions,
+            'quiz_category': category.id
+        })
+        data = response.get_json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data.get('question').get('id'), remaining.id)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_quiz_session(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 15)
+
+        response = self.client().post('/api/quizzes/sessions', json={
+            'quiz_category': category.id,
+            'limit': 10
+        })
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['total_questions'], 10)
+        session_id = data['session_id']
+
+        served = []
+        for i in range(10):
+            response = self.client().post('/api/quizzes', json={
+                'session_id': session_id
+            })
+            served.append(response.get_json()['question']['id'])
+        self.assertEqual(len(set(served)), 10)
+        self.assertTrue(set(served) <= {q.id for q in questions})
+
+        response = self.client().post(
+            '/api/quizzes/sessions/{}/next'.format(session_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {})
+
+        self.client().delete('/api/quizzes/sessions/{}'.format(session_id))
+        response = self.client().post(
+            '/api/quizzes/sessions/{}/next'.format(session_id))
+        self.assertEqual(response.status_code, 404)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_quiz_session_invalid_category(self):
+        response = self.client().post('/api/quizzes/sessions', json={
+            'quiz_category': 0
+        })
+        self.assertEqual(response.status_code, 400)
+        response = self.client().post('/api/quizzes/sessions', json={
+            'quiz_category': 'science'
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_quiz_session_category_as_string(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 3)
+
+        response = self.client().post('/api/quizzes/sessions', json={
+            'quiz_category': str(category.id)
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['total_questions'], 3)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_memory_session_store_eviction(self):
+        store = MemorySessionStore(ttl=3600, max_sessions=2)
+        first = store.create([1, 2])
+        second = store.create([3])
+        self.assertEqual(store.pop(first), 1)
+        store.create([4])
+        # second is least recently used one
+        self.assertRaises(SessionNotFound, store.pop, second)
+        self.assertEqual(store.pop(first), 2)
+        self.assertIsNone(store.pop(first))
+
+        store = MemorySessionStore(ttl=-1)
+        expired = store.create([1])
+        self.assertRaises(SessionNotFound, store.pop, expired)
+
+    def test_get_random_question_by_difficulty_and_weights(self):
+        science = Category("Science")
+        science.insert()
+        art = Category("Art")
+        art.insert()
+        questions = [
+            Question('Q1', 'A1', science.id, 1),
+            Question('Q2', 'A2', science.id, 5),
+            Question('Q3', 'A3', art.id, 5),
+        ]
+        for question in questions:
+            question.insert()
+
+        response = self.client().post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': science.id,
+            'difficulty': [4, 5]
+        })
+        self.assertEqual(response.get_json()['question']['id'],
+                         questions[1].id)
+
+        response = self.client().post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': None,
+            'categories': {str(science.id): 0, str(art.id): 1}
+        })
+        self.assertEqual(response.get_json()['question']['id'],
+                         questions[2].id)
+
+        response = self.client().post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': None,
+            'categories': {'0': 1}
+        })
+        self.assertEqual(response.status_code, 400)
+
+        self.delete_questions(questions)
+        science.delete()
+        art.delete()
+
+    def test_get_random_question_avoids_recent_for_client(self):
+        category = Category("Science")
+        category.insert()
+        questions = self.insert_questions_for_test(category, 3)
+
+        served = set()
+        for i in range(3):
+            response = self.client().post('/api/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': category.id,
+                'client_id': 'player-1'
+            })
+            served.add(response.get_json()['question']['id'])
+        self.assertEqual(served, {q.id for q in questions})
+
+        # all seen recently, repeats are allowed again
+        response = self.client().post('/api/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': category.id,
+            'client_id': 'player-1'
+        })
+        self.assertIn(response.get_json()['question']['id'], served)
+
+        self.delete_questions(questions)
+        category.delete()
+
+    def test_sampler_updates_incrementally(self):
+        category = Category("Science")
+        category.insert()
+        question = Question('Q1', 'A1', category.id, 2)
+        question.insert()
+        self.assertEqual(sampler.candidates({category.id: 1}), [question.id])
+
+        built_at = sampler.built_at
+        other = Question('Q2', 'A2', category.id, 3)
+        other.insert()
+        self.assertEqual(sorted(sampler.candidates({category.id: 1})),
+                         [question.id, other.id])
+        question.delete()
+        self.assertEqual(sampler.candidates({category.id: 1}), [other.id])
+        self.assertEqual(sampler.built_at, built_at)
+
+        other.delete()
+        category.delete()
+
+    def test_sampler_serves_stale_buckets_while_rebuilding(self):
+        category = Category("Science")
+        category.insert()
+        question = Question('Q1', 'A1', category.id, 2)
+        question.insert()
+        self.assertEqual(sampler.candidates({category.id: 1}), [question.id])
+
+        # Bulk changes expire buckets instead of dropping them
+        others = self.insert_questions_for_test(category, 2)
+        self.assertIsNotNone(sampler.buckets)
+        self.assertIsNone(sampler.built_at)
+
+        category_id, ids = category.id, [question.id] + \
+            [other.id for other in others]
+
+        # Another request is rebuilding, old buckets are served meanwhile
+        sampler.build_lock.acquire()
+        try:
+            queries = self.count_queries(lambda: self.app.response_class(
+                str(sampler.candidates({category_id: 1}))))
+            self.assertEqual(queries, 0)
+            self.assertEqual(sampler.candidates({category_id: 1}), ids[:1])
+        finally:
+            sampler.build_lock.release()
+        self.assertEqual(sorted(sampler.candidates({category_id: 1})), ids)
+        self.assertIsNotNone(sampler.built_at)
+
+    def test_sampler_rebuilds_after_changes_during_build(self):
+        category = Category("Science")
+        category.insert()
+        question = Question('Q1', 'A1', category.id, 2)
+        question.insert()
+
+        def change_during_scan(conn, cursor, statement, *args):
+            if 'FROM questions' in statement:
+                invalidate_questions()
+
+        engine = self.db.get_engine(self.app)
+        event.listen(engine, 'before_cursor_execute', change_during_scan)
+        try:
+            sampler.invalidate()
+            self.assertEqual(sampler.candidates({category.id: 1}),
+                             [question.id])
+        finally:
+            event.remove(engine, 'before_cursor_execute', change_during_scan)
+        # Buckets might miss the change, they are rebuilt on next use
+        self.assertIsNone(sampler.built_at)
+        sampler.candidates({category.id: 1})
+        self.assertIsNotNone(sampler.built_at)
+
+    def test_alias_table_distribution(self):
+        table = AliasTable([1, 3, 0, 6])
+        rng = Random(7)
+        counts = [0] * 4
+        for i in range(20000):
+            counts[table.sample(rng)] += 1
+        self.assertEqual(counts[2], 0)
+        self.assertAlmostEqual(counts[0] / 20000, 0.1, delta=0.02)
+        self.assertAlmostEqual(counts[1] / 20000, 0.3, delta=0.02)
+        self.assertAlmostEqual(counts[3] / 20000, 0.6, delta=0.02)
+
+    def test_recent_history(self):
+        history = RecentHistory(size=2, max_clients=1)
+        history.add('a', 1)
+        history.add('a', 2)
+        history.add('a', 3)
+        self.assertEqual(history.get('a'), {2, 3})
+        history.add('b', 4)
+        self.assertEqual(history.get('a'), set())
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":